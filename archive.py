@@ -0,0 +1,334 @@
+#!/bin/env python3
+
+from deye import rModbusResponse, DeyeTCPResponse, FrameError, ModbusRequest, readFrames
+from batch import BatchDecoder
+
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+import datetime
+
+import numpy as np
+
+
+class ArchiveFormat:
+    # Segment files start with a 64 byte header, followed by fixed 256 byte
+    # records: float64 timestamp, uint32 InvSerial, 4 reserved bytes and the
+    # raw register block exactly as the inverter sent it. Records stay 8 byte
+    # aligned, so the NumPy views over an mmap need no copies.
+    MAGIC = b"DEYEARC1"
+    HEADER = struct.Struct("<8sHHH")
+    HEADER_SIZE = 64
+    RECORD_HEADER = struct.Struct("<dI4x")
+    SUFFIX = ".seg"
+    INDEX_SUFFIX = ".idx"
+    SUMMARY = "index.json"
+    # Per segment index: records sorted by serial, then time
+    INDEX_DTYPE = np.dtype([("serial", "<u4"), ("time", "<f8"), ("row", "<u4")])
+
+    def __init__(self, decoder=rModbusResponse.decoder):
+        self.decoder = decoder
+        self.block_size = decoder.size
+        self.record_size = self.RECORD_HEADER.size + self.block_size
+        batch = BatchDecoder(decoder)
+        self.batch = batch
+        names = ["time", "serial"] + list(batch.dtype.names)
+        formats = ["<f8", "<u4"] + [batch.dtype.fields[name][0] for name in batch.dtype.names]
+        offsets = [0, 8] + [self.RECORD_HEADER.size + batch.dtype.fields[name][1] for name in batch.dtype.names]
+        self.dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": self.record_size})
+
+    def header(self):
+        return self.HEADER.pack(self.MAGIC, self.HEADER_SIZE, self.record_size, self.block_size).ljust(self.HEADER_SIZE, b"\0")
+
+    def checkHeader(self, path, data):
+        magic, header_size, record_size, block_size = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC or header_size != self.HEADER_SIZE:
+            raise ValueError(f"{path} is not an archive segment")
+        if record_size != self.record_size or block_size != self.block_size:
+            raise ValueError(f"{path} holds {block_size} byte blocks, expected {self.block_size}")
+
+    @staticmethod
+    def segmentName(number):
+        return f"{number:08d}{ArchiveFormat.SUFFIX}"
+
+    @staticmethod
+    def segments(path):
+        return sorted(name for name in os.listdir(path) if name.endswith(ArchiveFormat.SUFFIX))
+
+    def buildIndex(self, records):
+        index = np.empty(len(records), self.INDEX_DTYPE)
+        index["serial"] = records["serial"]
+        index["time"] = records["time"]
+        index["row"] = np.arange(len(records), dtype=np.uint32)
+        return np.sort(index, order=["serial", "time"], kind="stable")
+
+
+class ArchiveWriter:
+    # Appends records to the newest segment of the archive directory and
+    # starts a new one after segment_records. Full segments are sealed with
+    # a serial/time index and an entry in index.json; the open segment is
+    # indexed by the reader when it is queried.
+
+    def __init__(self, path, segment_records=262144, decoder=rModbusResponse.decoder):
+        self.path = path
+        self.segment_records = segment_records
+        self.format = ArchiveFormat(decoder)
+        self.f = None
+        os.makedirs(path, exist_ok=True)
+        names = ArchiveFormat.segments(path)
+        self.number = int(names[-1][:-len(ArchiveFormat.SUFFIX)]) if names else 0
+        self.open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def segmentPath(self, number=None):
+        return os.path.join(self.path, ArchiveFormat.segmentName(self.number if number is None else number))
+
+    def open(self):
+        path = self.segmentPath()
+        self.f = open(path, "ab")
+        size = self.f.tell()
+        if size == 0:
+            self.f.write(self.format.header())
+            self.count = 0
+            return
+        with open(path, "rb") as f:
+            self.format.checkHeader(path, f.read(ArchiveFormat.HEADER_SIZE))
+        # A crash can leave half a record at the end
+        self.count = (size - ArchiveFormat.HEADER_SIZE) // self.format.record_size
+        self.f.truncate(ArchiveFormat.HEADER_SIZE + self.count * self.format.record_size)
+        if self.count >= self.segment_records:
+            self.rollover()
+
+    def append(self, ts, serial, block):
+        if len(block) != self.format.block_size:
+            raise ValueError(f"Register block must be {self.format.block_size} bytes, got {len(block)}")
+        self.f.write(ArchiveFormat.RECORD_HEADER.pack(ts, serial))
+        self.f.write(block)
+        self.count += 1
+        if self.count >= self.segment_records:
+            self.rollover()
+
+    def appendFrame(self, frame, ts=None):
+        # Stores the register block of a full read response, returns False
+        # for frames that are not one
+        try:
+            DeyeTCPResponse.validate(frame)
+        except FrameError:
+            return False
+        offset = DeyeTCPResponse.MODBUS_OFFSET
+        if frame[offset:offset + 2] != bytes.fromhex(ModbusRequest.DEYE_READ) or frame[offset + 2] != self.format.block_size:
+            return False
+        serial = int.from_bytes(frame[7:11], "little")
+        self.append(time.time() if ts is None else ts, serial, frame[offset + 3:offset + 3 + self.format.block_size])
+        return True
+
+    def flush(self):
+        self.f.flush()
+
+    def rollover(self):
+        self.seal()
+        self.number += 1
+        self.open()
+
+    def seal(self):
+        self.f.close()
+        path = self.segmentPath()
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            records = np.ndarray(self.count, self.format.dtype, mm, ArchiveFormat.HEADER_SIZE)
+            index = self.format.buildIndex(records)
+            summary = segmentSummary(records)
+            del records
+        with open(path[:-len(ArchiveFormat.SUFFIX)] + ArchiveFormat.INDEX_SUFFIX, "wb") as f:
+            np.save(f, index)
+        summaries = loadSummaries(self.path)
+        summaries[os.path.basename(path)] = summary
+        tmp = os.path.join(self.path, ArchiveFormat.SUMMARY + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(summaries, f)
+        os.replace(tmp, os.path.join(self.path, ArchiveFormat.SUMMARY))
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def segmentSummary(records):
+    if len(records) == 0:
+        return {"count": 0}
+    return {
+        "count": int(len(records)),
+        "min_time": float(records["time"].min()),
+        "max_time": float(records["time"].max()),
+        "min_serial": int(records["serial"].min()),
+        "max_serial": int(records["serial"].max()),
+    }
+
+
+def loadSummaries(path):
+    try:
+        with open(os.path.join(path, ArchiveFormat.SUMMARY)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class Segment:
+    def __init__(self, path, format, summary=None):
+        self.path = path
+        self.f = open(path, "rb")
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        format.checkHeader(path, self.mm)
+        count = (len(self.mm) - ArchiveFormat.HEADER_SIZE) // format.record_size
+        self.records = np.ndarray(count, format.dtype, self.mm, ArchiveFormat.HEADER_SIZE)
+        self.format = format
+        self._index = None
+        if summary is None or summary["count"] != count:
+            summary = segmentSummary(self.records)
+        self.summary = summary
+
+    @property
+    def index(self):
+        if self._index is None:
+            path = self.path[:-len(ArchiveFormat.SUFFIX)] + ArchiveFormat.INDEX_SUFFIX
+            if os.path.exists(path):
+                self._index = np.load(path, mmap_mode="r")
+            if self._index is None or len(self._index) != len(self.records):
+                self._index = self.format.buildIndex(self.records)
+        return self._index
+
+    def overlaps(self, serial, start, end):
+        s = self.summary
+        if s["count"] == 0:
+            return False
+        if serial is not None and not s["min_serial"] <= serial <= s["max_serial"]:
+            return False
+        return (start is None or s["max_time"] >= start) and (end is None or s["min_time"] < end)
+
+    def rows(self, serial, start, end):
+        # Record numbers for serial (None for all) with start <= time < end,
+        # ordered by time
+        if serial is None:
+            mask = np.ones(len(self.records), bool)
+            if start is not None:
+                mask &= self.records["time"] >= start
+            if end is not None:
+                mask &= self.records["time"] < end
+            rows = np.flatnonzero(mask)
+            return rows[np.argsort(self.records["time"][rows], kind="stable")]
+        index = self.index
+        lo, hi = np.searchsorted(index["serial"], [serial, serial + 1])
+        times = index["time"][lo:hi]
+        first = lo + (0 if start is None else np.searchsorted(times, start))
+        last = lo + (len(times) if end is None else np.searchsorted(times, end))
+        return np.asarray(index["row"][first:last], np.intp)
+
+    def close(self):
+        self.records = None
+        self._index = None
+        try:
+            self.mm.close()
+        except BufferError:
+            # Views handed out by field() or query() still use the map, it
+            # is unmapped when the last of them is released
+            pass
+        self.f.close()
+
+
+class ArchiveReader:
+    # Maps every segment read-only. records(segment) is a structured view of
+    # the file with one zero-copy column per modbus_parsemap field, query()
+    # prunes segments with index.json and reads only the matching records.
+
+    def __init__(self, path, decoder=rModbusResponse.decoder):
+        self.path = path
+        self.format = ArchiveFormat(decoder)
+        summaries = loadSummaries(path)
+        self.segments = [Segment(os.path.join(path, name), self.format, summaries.get(name)) for name in ArchiveFormat.segments(path)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return sum(len(segment.records) for segment in self.segments)
+
+    def field(self, name, segment=0):
+        # Raw register values of one field, a strided view into the mmap
+        return self.segments[segment].records[name]
+
+    def query(self, names, serial=None, start=None, end=None):
+        # Returns time, serial and the converted values of each name for the
+        # records in [start, end), optionally of one serial
+        if isinstance(names, str):
+            names = [names]
+        start, end = epoch(start), epoch(end)
+        parts = []
+        for segment in self.segments:
+            if segment.overlaps(serial, start, end):
+                rows = segment.rows(serial, start, end)
+                if len(rows):
+                    parts.append(segment.records[rows])
+        records = np.concatenate(parts) if parts else np.empty(0, self.format.dtype)
+        if serial is None and len(parts) > 1:
+            records = records[np.argsort(records["time"], kind="stable")]
+        out = {"time": records["time"], "serial": records["serial"]}
+        for name in names:
+            out[name] = self.format.batch.convert(records, name)
+        return out
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+
+def epoch(value):
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="archive.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+    store = commands.add_parser("import", help="append the frames of a hex or raw capture")
+    store.add_argument("capture")
+    store.add_argument("archive")
+    store.add_argument("--segment-records", type=int, default=262144)
+    query = commands.add_parser("query", help="print one field as ndjson")
+    query.add_argument("archive")
+    query.add_argument("field")
+    query.add_argument("--serial", type=int, default=None)
+    query.add_argument("--start", type=datetime.datetime.fromisoformat, default=None)
+    query.add_argument("--end", type=datetime.datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        stored = skipped = 0
+        with open(args.capture, "rb") as f, ArchiveWriter(args.archive, args.segment_records) as writer:
+            for frame in readFrames(f):
+                if writer.appendFrame(frame):
+                    stored += 1
+                else:
+                    skipped += 1
+        print(f"[+] Stored {stored} frames, skipped {skipped}")
+    else:
+        with ArchiveReader(args.archive) as reader:
+            out = reader.query(args.field, args.serial, args.start, args.end)
+            for ts, serial, value in zip(out["time"], out["serial"], out[args.field]):
+                sys.stdout.write(json.dumps({"time": float(ts), "InvSerial": int(serial), args.field: value.tolist()}) + "\n")
+
+if __name__ == '__main__':
+    main()
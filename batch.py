@@ -0,0 +1,77 @@
+from deye import rModbusResponse, DeyeTCPResponse
+
+import numpy as np
+
+
+class BatchDecoder:
+    # Decodes many full register reads at once. The register blocks are
+    # stacked into one array viewed through a structured dtype built from the
+    # modbus_parsemap layout, scale dividers are then applied column-wise.
+    # hex and bytes fields are returned as uint8 arrays of their raw bytes.
+
+    def __init__(self, decoder=rModbusResponse.decoder):
+        self.decoder = decoder
+        self.columns = {}
+        names, formats, offsets = [], [], []
+        for name, register in decoder.registers.items():
+            offset, size = decoder.index[name]
+            fmt, divider, words = self.columnType(register)
+            names.append(name)
+            formats.append(fmt)
+            offsets.append(offset)
+            self.columns[name] = (divider, words)
+        self.dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": decoder.size})
+
+    @staticmethod
+    def columnType(register):
+        kind, bits = register.kind, register.bits
+        if kind in ("hex", "bytes"):
+            return (np.uint8, (register.size,)), None, 1
+        order = "<" if kind.endswith("le") else ">"
+        sign = "u" if kind.startswith("u") else "i"
+        if bits == 32 and register.order == "little":
+            return (f">{sign}2", (2,)), register.scale, 2
+        return f"{order}{sign}{bits // 8}", register.scale, 1
+
+    def stack(self, frames):
+        # frames are raw bytes or hex strings of equally long responses
+        frames = list(frames)
+        if not frames:
+            return np.zeros((0, 0), np.uint8)
+        if isinstance(frames[0], str):
+            frames = [bytes.fromhex(frame) for frame in frames]
+        length = len(frames[0])
+        for i, frame in enumerate(frames):
+            if len(frame) != length:
+                raise ValueError(f"All frames must have the same length, frame {i} has {len(frame)} bytes, expected {length}")
+        return np.frombuffer(b"".join(frames), np.uint8).reshape(len(frames), length)
+
+    def valid(self, stacked):
+        offset = DeyeTCPResponse.MODBUS_OFFSET
+        checksum = (stacked[:, 1:-2].sum(axis=1, dtype=np.uint32) & 255) == stacked[:, -2]
+        return checksum & (stacked[:, offset] == 0x01) & (stacked[:, offset + 1] == 0x03) & (stacked[:, offset + 2] >= self.decoder.size)
+
+    def blocks(self, stacked):
+        start = DeyeTCPResponse.MODBUS_OFFSET + 3
+        if stacked.shape[1] < start + self.decoder.size:
+            raise ValueError(f"Frames are too short for a {self.decoder.size} byte register block")
+        return np.ascontiguousarray(stacked[:, start:start + self.decoder.size]).view(self.dtype)[:, 0]
+
+    def convert(self, records, name):
+        column = records[name]
+        divider, words = self.columns[name]
+        if words == 2:
+            column = (column[:, 1].astype(np.int64) << 16) + column[:, 0]
+        if divider is not None:
+            return column / divider
+        return column
+
+    def decode(self, frames, names=None):
+        # Returns one array per field plus a "valid" mask for frames that are
+        # not full Modbus read responses; their values are meaningless.
+        stacked = self.stack(frames)
+        records = self.blocks(stacked)
+        out = {"valid": self.valid(stacked)}
+        for name in names or self.columns:
+            out[name] = self.convert(records, name)
+        return out
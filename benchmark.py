@@ -0,0 +1,318 @@
+#!/bin/env python3
+
+from deye import *
+from simulator import SAMPLE_RESPONSE, Simulator
+
+import sys
+import time
+import json
+import timeit
+import argparse
+import resource
+import tracemalloc
+import os
+import tempfile
+import libscrc
+
+SERIAL = 3972135441
+LAZY_FIELDS = ("sActivePower", "sGridVoltage", "sTemperature")
+
+
+def legacyValues(response):
+    out = {}
+    for k, v in response.values["ModbusResponse"].values.items():
+        if k in rModbusResponse.decoder.index:
+            value = v.value
+            out[k] = value.value if isinstance(value, InformationObj) else value
+    return out
+
+
+def legacyModbusCRC(rawbytes):
+    modbus_crc = bytearray.fromhex("{:04x}".format(libscrc.modbus(rawbytes[0:6])))
+    modbus_crc.reverse()
+    return modbus_crc
+
+
+def legacyFrameChecksum(rawbytes):
+    checksum = 0
+    for i in range(1, len(rawbytes) - 2, 1):
+        checksum += rawbytes[i] & 255
+    return int((checksum & 255))
+
+
+def check():
+    # The fast paths must agree with the reference implementation
+    reference = legacyValues(DeyeTCPResponse(SAMPLE_RESPONSE))
+    if rModbusResponse.decoder.decodeFrame(SAMPLE_RESPONSE) != reference:
+        raise AssertionError("Compiled decoder differs from bitstring parser")
+    if dict(DeyeTCPResult(SAMPLE_RESPONSE).items()) != reference:
+        raise AssertionError("DeyeTCPResult differs from bitstring parser")
+    lazy = DeyeTCPResponse.lazy(SAMPLE_RESPONSE)
+    if any(lazy[name] != reference[name] for name in LAZY_FIELDS):
+        raise AssertionError("Lazy response differs from bitstring parser")
+    request = DeyeTCPRequest(ModbusRequest(ModbusRequest.DEYE_READ, 0, 120), SERIAL)
+    if legacyModbusCRC(request.modbus_frame) != request.modbus_frame[6:8] or legacyFrameChecksum(request.rawbytes) != request.rawbytes[-2]:
+        raise AssertionError("Checksums differ from the previous implementation")
+    template = FrameTemplate.get(ModbusRequest.DEYE_READ, 0, 120, SERIAL)
+    if bytes(template.stamp(int.from_bytes(request.sn_prefix, "big"))) != request.toBytes():
+        raise AssertionError("Template frame differs from DeyeTCPRequest")
+    response = DeyeTCPResponse(SAMPLE_RESPONSE)
+    response.update_recursive()
+    if response.toBytes() != SAMPLE_RESPONSE:
+        raise AssertionError("update_recursive does not re-encode the parsed frame")
+
+
+def readLazy():
+    response = DeyeTCPResponse.lazy(SAMPLE_RESPONSE)
+    return [response[name] for name in LAZY_FIELDS]
+
+
+def profileCase():
+    # Model detection plus the cached decoder, as in a mixed fleet
+    from profiles import PROFILES
+    return lambda: PROFILES.decodeFrame(SAMPLE_RESPONSE)
+
+
+def encodeCase():
+    response = DeyeTCPResponse(SAMPLE_RESPONSE)
+    return response.update_recursive
+
+
+def transportCase():
+    # The loopback simulator runs in a thread of this process, so its
+    # allocations are included in the traced bytes per op
+    simulator = Simulator(1, latency=0, jitter=0, vary=False, first_serial=SERIAL)
+    ip, port = simulator.startThread()[0]
+    tcp = TransportTCP(ip, port)
+    tcp.start()
+    template = FrameTemplate.get(ModbusRequest.DEYE_READ, 0, 120, SERIAL)
+
+    def roundtrip():
+        return DeyeTCPResult(tcp.send(template.stamp()))
+
+    def close():
+        tcp.stop()
+        simulator.stopThread()
+
+    return roundtrip, close
+
+
+def instrumentedCase(name):
+    # Same op with metrics hooks installed, to measure their overhead
+    def setup():
+        import metrics
+        op = CASES[name][0]()
+        teardown = None
+        if isinstance(op, tuple):
+            op, teardown = op
+        metrics.instrument()
+
+        def close():
+            metrics.uninstrument()
+            if teardown is not None:
+                teardown()
+
+        return op, close
+
+    return setup
+
+
+# name: (setup returning the op, or (op, teardown), default number of ops)
+CASES = {
+    "request.modbus": (lambda: lambda: ModbusRequest(ModbusRequest.DEYE_READ, 0, 120), 20000),
+    "request.deye": (lambda: lambda: DeyeTCPRequest(ModbusRequest(ModbusRequest.DEYE_READ, 0, 120), SERIAL).toBytes(), 20000),
+    "request.template": (lambda: lambda: FrameTemplate.get(ModbusRequest.DEYE_READ, 0, 120, SERIAL).stamp(), 20000),
+    "checksum.modbus_legacy": (lambda: lambda: legacyModbusCRC(SAMPLE_RESPONSE[25:31]), 20000),
+    "checksum.modbus": (lambda: lambda: modbusCRCBytes(SAMPLE_RESPONSE[25:31]), 20000),
+    "checksum.frame_legacy": (lambda: lambda: legacyFrameChecksum(SAMPLE_RESPONSE), 5000),
+    "checksum.frame": (lambda: lambda: frameChecksum(SAMPLE_RESPONSE), 20000),
+    "checksum.validate": (lambda: lambda: DeyeTCPResponse.validate(SAMPLE_RESPONSE), 20000),
+    "decode.bitstring": (lambda: lambda: DeyeTCPResponse(SAMPLE_RESPONSE), 500),
+    "decode.compiled": (lambda: lambda: rModbusResponse.decoder.decodeFrame(SAMPLE_RESPONSE), 10000),
+    "decode.result": (lambda: lambda: DeyeTCPResult(SAMPLE_RESPONSE).items(), 10000),
+    "decode.lazy3": (lambda: readLazy, 10000),
+    "decode.profile": (profileCase, 10000),
+    "encode.update_recursive": (encodeCase, 500),
+    "transport.roundtrip": (transportCase, 2000),
+}
+CASES["metrics.decode"] = (instrumentedCase("decode.bitstring"), 500)
+CASES["metrics.roundtrip"] = (instrumentedCase("transport.roundtrip"), 2000)
+
+
+def measure(name, op, number):
+    for i in range(max(1, number // 20)):
+        op()
+    clock = time.perf_counter_ns
+    times = []
+    blocks = sys.getallocatedblocks()
+    for i in range(number):
+        start = clock()
+        op()
+        times.append(clock() - start)
+    blocks = sys.getallocatedblocks() - blocks
+    # Peak bytes allocated while one op runs, traced on a sample of ops
+    tracemalloc.start()
+    allocated = 0
+    sample = min(number, 100)
+    for i in range(sample):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        op()
+        allocated += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    times.sort()
+    return {
+        "name": name,
+        "ops": number,
+        "ops_per_sec": number / (sum(times) / 1e9),
+        "p50_us": times[len(times) // 2] / 1e3,
+        "p99_us": times[min(len(times) - 1, len(times) * 99 // 100)] / 1e3,
+        "alloc_bytes_per_op": allocated / sample,
+        "retained_blocks_per_op": blocks / number,
+    }
+
+
+def runCase(name, number=None):
+    setup, default = CASES[name]
+    op = setup()
+    teardown = None
+    if isinstance(op, tuple):
+        op, teardown = op
+    try:
+        return measure(name, op, number or default)
+    finally:
+        if teardown is not None:
+            teardown()
+
+
+def printResult(result, baseline=None):
+    line = f"{result['name']:<28} {result['ops_per_sec']:>12.0f} ops/s p50 {result['p50_us']:>9.2f} us p99 {result['p99_us']:>9.2f} us {result['alloc_bytes_per_op']:>9.0f} B/op"
+    if baseline and result["name"] in baseline:
+        line += f" {result['ops_per_sec'] / baseline[result['name']]['ops_per_sec']:>6.2f}x"
+    print(line)
+
+
+def report(name, number, seconds):
+    print(f"{name:<40} {number / seconds:>12.0f} ops/s {seconds / number * 1e6:>10.2f} us/op")
+
+
+def benchRetained(number=100):
+    # Bytes still referenced after building number responses, per response
+    for name, fn in (("DeyeTCPResponse", DeyeTCPResponse), ("DeyeTCPResult", DeyeTCPResult)):
+        tracemalloc.start()
+        keep = [fn(SAMPLE_RESPONSE) for i in range(number)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{name} retained {size / number:.0f} bytes/frame")
+
+
+def benchBatch(number=1000000, sample=1000):
+    from batch import BatchDecoder
+    decoder = BatchDecoder()
+    frames = [SAMPLE_RESPONSE.hex()] * number
+    start = time.perf_counter()
+    columns = decoder.decode(frames)
+    seconds = time.perf_counter() - start
+    if columns["sGridVoltage"][0] != DeyeTCPResult(SAMPLE_RESPONSE)["sGridVoltage"]:
+        raise AssertionError("Batch decoder differs from per-object path")
+    report(f"batch NumPy decode of {number} frames", number, seconds)
+    seconds = timeit.timeit(lambda: DeyeTCPResponse(bytes.fromhex(frames[0])), number=sample)
+    report("per-object DeyeTCPResponse", sample, seconds)
+    print(f"per-object estimate for {number} frames: {seconds / sample * number:.0f} s")
+
+
+def benchReplay(number=20000, workers=(1, 2, 4, 8)):
+    with tempfile.NamedTemporaryFile("w", suffix=".hex", delete=False) as f:
+        for i in range(number):
+            f.write(SAMPLE_RESPONSE.hex() + "\n")
+    try:
+        for n in workers:
+            with open(os.devnull, "w") as out:
+                start = time.perf_counter()
+                replay(f.name, out, workers=n)
+                seconds = time.perf_counter() - start
+            report(f"replay ndjson, {n} workers", number, seconds)
+    finally:
+        os.unlink(f.name)
+
+
+def benchSoak(number=1000000, chunk=50000):
+    # Memory and per-frame time must stay flat over a long-running poll
+    chunk = min(chunk, number)
+    done = 0
+    while done < number:
+        start = time.perf_counter()
+        for i in range(chunk):
+            DeyeTCPResponse(SAMPLE_RESPONSE)
+        seconds = time.perf_counter() - start
+        done += chunk
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"soak {done:>9} frames {seconds / chunk * 1e6:>10.2f} us/frame maxrss {maxrss} KiB parsemap {len(rModbusResponse.parsemap)}")
+
+
+def benchImport(number=10):
+    # Fresh interpreters, so module caches do not hide the import cost
+    import subprocess
+    times = []
+    for i in range(number):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import deye"], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(number):
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+    empty = (time.perf_counter() - start) / number
+    print(f"import deye {(min(times) - empty) * 1e3:.1f} ms over interpreter start, best of {number}")
+
+
+# Longer studies, only run when named
+STUDIES = {
+    "retained": benchRetained,
+    "batch": benchBatch,
+    "replay": benchReplay,
+    "soak": benchSoak,
+    "import": benchImport,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmark.py")
+    parser.add_argument("names", nargs="*", help="cases or case prefixes (decode, request.deye), or studies (soak=20000)")
+    parser.add_argument("--number", type=int, default=None, help="ops per case")
+    parser.add_argument("--json", default=None, help="write results as JSON to this file, - for stdout")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run to compare against")
+    args = parser.parse_args()
+
+    check()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {result["name"]: result for result in json.load(f)["results"]}
+
+    cases = []
+    for arg in args.names or list(CASES):
+        name, _, number = arg.partition("=")
+        if name in STUDIES:
+            STUDIES[name](*([int(number)] if number else []))
+            continue
+        matched = [case for case in CASES if case == name or case.startswith(name + ".")]
+        if not matched:
+            parser.error(f"unknown benchmark {name}")
+        cases += [(case, int(number) if number else args.number) for case in matched]
+
+    results = []
+    for name, number in cases:
+        result = runCase(name, number)
+        results.append(result)
+        if args.json != "-":
+            printResult(result, baseline)
+    if args.json:
+        doc = {"python": sys.version.split()[0], "time": time.time(), "results": results}
+        if args.json == "-":
+            json.dump(doc, sys.stdout, indent=1)
+        else:
+            with open(args.json, "w") as f:
+                json.dump(doc, f, indent=1)
+
+if __name__ == '__main__':
+    main()
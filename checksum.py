@@ -0,0 +1,33 @@
+import libscrc
+
+# Checksums of the Deye TCP frame (8 bit sum of everything between the start
+# byte and the checksum itself) and of the embedded Modbus RTU frame (CRC16,
+# sent low byte first). Both work on any buffer without copying it.
+
+# Shortest Modbus frame that carries a CRC: address, function, one byte, CRC
+MODBUS_MIN_LENGTH = 5
+
+
+def modbusCRC(data):
+    return libscrc.modbus(data)
+
+
+def modbusCRCBytes(data):
+    return libscrc.modbus(data).to_bytes(2, "little")
+
+
+def verifyModbusCRC(data):
+    # The CRC over a frame including its own CRC is zero
+    return len(data) >= MODBUS_MIN_LENGTH and libscrc.modbus(data) == 0
+
+
+def frameChecksum(frame, start=0, length=None):
+    # Checksum of the frame at frame[start:start + length]
+    if length is None:
+        length = len(frame) - start
+    with memoryview(frame) as view:
+        return sum(view[start + 1:start + length - 2]) & 255
+
+
+def verifyFrameChecksum(frame):
+    return len(frame) >= 3 and frameChecksum(frame) == frame[-2]
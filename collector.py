@@ -0,0 +1,353 @@
+#!/bin/env python3
+
+from deye import DeyeTCPResult, FrameTemplate, FrameError, ModbusRequest, plainValue
+from deye_async import AsyncDeyeClient
+from discovery import SerialCache
+
+import os
+import sys
+import json
+import time
+import array
+import struct
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+
+def records(samples):
+    # (time, ip, port, frame) samples to flat dicts, undecodable frames
+    # become records with an error
+    for ts, ip, port, frame in samples:
+        record = {"time": ts, "logger": f"{ip}:{port}"}
+        try:
+            result = DeyeTCPResult(frame)
+            record["InvSerial"] = result.invSerial
+            for name, value in result.items():
+                record[name] = plainValue(value)
+        except (FrameError, ValueError) as e:
+            record["error"] = repr(e)
+        yield record
+
+
+def select(fields):
+    # Stage keeping only the given fields next to time, logger and InvSerial
+    keep = {"time", "logger", "InvSerial", "error"} | set(fields)
+
+    def stage(items):
+        for record in items:
+            yield {k: v for k, v in record.items() if k in keep}
+
+    return stage
+
+
+class NDJSONSink:
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+
+    def write(self, batch):
+        self.stream.write("".join(json.dumps(record) + "\n" for record in batch))
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+
+class RotatingFileSink(NDJSONSink):
+    # NDJSON file renamed to path.1 .. path.N once it reaches max_bytes
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        super().__init__(open(path, "a"))
+
+    def write(self, batch):
+        super().write(batch)
+        if self.stream.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.stream.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.unlink(self.path)
+        self.stream = open(self.path, "a")
+
+    def close(self):
+        self.stream.close()
+
+
+class ColumnarSink:
+    # Append-only column blocks: a header line naming the columns, then per
+    # batch the row count followed by each column as a packed array.
+    # Non-numeric and missing values are stored as NaN.
+    MAGIC = b"DCOL1\n"
+    BLOCK = struct.Struct("<4sI")
+    BLOCK_TAG = b"BLK0"
+    TIME = ("time", "d")
+    SERIAL = ("InvSerial", "I")
+
+    def __init__(self, path, fields=None, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.columns = None
+        self.f = open(path, "ab")
+        if self.f.tell() > 0:
+            self.columns = readColumnarHeader(path)
+        elif fields is not None:
+            self.writeHeader(fields)
+
+    def writeHeader(self, fields):
+        self.columns = [self.TIME, self.SERIAL] + [(name, "d") for name in fields]
+        self.f.write(self.MAGIC + json.dumps({"columns": self.columns}).encode() + b"\n")
+
+    def write(self, batch):
+        batch = [record for record in batch if "error" not in record]
+        if not batch:
+            return
+        if self.columns is None:
+            self.writeHeader([k for k, v in batch[0].items() if k not in ("time", "logger", "InvSerial") and isinstance(v, (int, float))])
+        self.f.write(self.BLOCK.pack(self.BLOCK_TAG, len(batch)))
+        for name, typecode in self.columns:
+            if typecode == "d":
+                column = array.array("d", (numeric(record.get(name)) for record in batch))
+            else:
+                column = array.array(typecode, (record.get(name, 0) for record in batch))
+            self.f.write(column.tobytes())
+
+    def flush(self):
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def numeric(value):
+    if isinstance(value, (int, float)):
+        return value
+    return float("nan")
+
+
+def readColumnarHeader(path):
+    with open(path, "rb") as f:
+        if f.read(len(ColumnarSink.MAGIC)) != ColumnarSink.MAGIC:
+            raise ValueError(f"{path} is not a columnar sample file")
+        return [tuple(column) for column in json.loads(f.readline())["columns"]]
+
+
+def readColumnar(path, fields=None):
+    # Concatenates every block into one array per column
+    columns = readColumnarHeader(path)
+    wanted = [name for name, typecode in columns if fields is None or name in fields or name in ("time", "InvSerial")]
+    out = {name: array.array(typecode) for name, typecode in columns if name in wanted}
+    with open(path, "rb") as f:
+        f.read(len(ColumnarSink.MAGIC))
+        f.readline()
+        while True:
+            head = f.read(ColumnarSink.BLOCK.size)
+            if len(head) < ColumnarSink.BLOCK.size:
+                break
+            tag, rows = ColumnarSink.BLOCK.unpack(head)
+            if tag != ColumnarSink.BLOCK_TAG:
+                raise ValueError(f"Corrupt block in {path}")
+            for name, typecode in columns:
+                size = rows * array.array(typecode).itemsize
+                if name in out:
+                    out[name].frombytes(f.read(size))
+                else:
+                    f.seek(size, os.SEEK_CUR)
+    return out
+
+
+class Collector:
+    # Polls every (ip, port) each interval and streams the samples through
+    # the generator stages into the sinks. Pollers block on the bounded
+    # queue while the sinks fall behind, so memory stays flat however long
+    # it runs; batches are written when batch_size samples are queued or
+    # flush_interval has passed.
+
+    def __init__(self, addresses, sinks, interval=10, start_reg=0, count_reg=120, stages=(), queue_size=10000, batch_size=500, flush_interval=1.0, timeout=5, concurrency=200, max_backoff=600, serial_cache=None, clock=time.time):
+        self.addresses = list(addresses)
+        self.sinks = list(sinks)
+        self.interval = interval
+        self.start_reg = start_reg
+        self.count_reg = count_reg
+        self.stages = [records] + list(stages)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.max_backoff = max_backoff
+        self.serial_cache = serial_cache
+        self.clock = clock
+        self.polled = 0
+        self.errors = 0
+        self.written = 0
+
+    def pipeline(self, batch):
+        items = iter(batch)
+        for stage in self.stages:
+            items = stage(items)
+        return items
+
+    def writeBatch(self, batch):
+        batch = list(self.pipeline(batch))
+        for sink in self.sinks:
+            sink.write(batch)
+            sink.flush()
+        self.written += len(batch)
+
+    async def readFrame(self, client):
+        if client.serial is None:
+            await client.discover()
+        for attempt in range(2):
+            template = FrameTemplate.get(ModbusRequest.DEYE_READ, self.start_reg, self.count_reg, client.serial)
+            frame = await client.transport.send(bytes(template.stamp()))
+            if not frame:
+                raise ConnectionError("Logger closed the connection")
+            serial = int.from_bytes(frame[7:11], "little")
+            if serial == client.serial:
+                break
+            if self.serial_cache is not None:
+                self.serial_cache.check(client.ip, client.port, client.serial, serial)
+            client.serial = serial
+        return frame
+
+    async def poll(self, ip, port, offset):
+        loop = asyncio.get_running_loop()
+        client = AsyncDeyeClient(ip, port, timeout=self.timeout, serial_cache=self.serial_cache)
+        connected = False
+        failures = 0
+        due = loop.time() + offset
+        try:
+            while not self.stopped.done():
+                # Waits on the stop future as well as the cancel in run(),
+                # which wait_for can swallow when a reply arrives with it
+                await asyncio.wait({self.stopped}, timeout=max(0, due - loop.time()))
+                if self.stopped.done():
+                    break
+                try:
+                    async with self.semaphore:
+                        if not connected:
+                            await client.connect()
+                            connected = True
+                        frame = await self.readFrame(client)
+                except (OSError, asyncio.TimeoutError, FrameError) as e:
+                    self.errors += 1
+                    failures += 1
+                    if connected:
+                        await client.close()
+                        connected = False
+                    due = loop.time() + min(self.interval * 2 ** (failures - 1), self.max_backoff)
+                    continue
+                failures = 0
+                self.polled += 1
+                await self.queue.put((self.clock(), ip, port, frame))
+                due = max(due + self.interval, loop.time())
+        finally:
+            if connected:
+                await client.close()
+
+    async def drain(self, done):
+        loop = asyncio.get_running_loop()
+        getter = None
+        while not (done.is_set() and self.queue.empty()):
+            if getter is None:
+                getter = asyncio.ensure_future(self.queue.get())
+            await asyncio.wait({getter}, timeout=self.flush_interval)
+            if not getter.done():
+                continue
+            batch = [getter.result()]
+            getter = None
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0 or done.is_set():
+                    break
+                getter = asyncio.ensure_future(self.queue.get())
+                await asyncio.wait({getter}, timeout=remaining)
+                if not getter.done():
+                    break
+                batch.append(getter.result())
+                getter = None
+            await loop.run_in_executor(self.executor, self.writeBatch, batch)
+        if getter is not None:
+            getter.cancel()
+
+    async def run(self, duration=None):
+        # Runs until duration seconds have passed or the task is cancelled,
+        # then writes what is still queued and closes the sinks
+        self.queue = asyncio.Queue(self.queue_size)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.executor = ThreadPoolExecutor(1)
+        self.stopped = asyncio.get_running_loop().create_future()
+        done = asyncio.Event()
+        count = max(1, len(self.addresses))
+        pollers = [asyncio.create_task(self.poll(ip, port, self.interval * i / count)) for i, (ip, port) in enumerate(self.addresses)]
+        drainer = asyncio.create_task(self.drain(done))
+        try:
+            if duration is None:
+                await asyncio.gather(*pollers)
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            self.stopped.set_result(None)
+            for task in pollers:
+                task.cancel()
+            await asyncio.gather(*pollers, return_exceptions=True)
+            done.set()
+            await drainer
+            self.executor.shutdown()
+            for sink in self.sinks:
+                sink.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="deye.py collect")
+    parser.add_argument("addresses", nargs="+", help="ip:port of each logger")
+    parser.add_argument("--interval", type=float, default=10)
+    parser.add_argument("--sink", choices=["ndjson", "rotating", "columnar"], action="append", help="default ndjson on stdout, may be repeated")
+    parser.add_argument("--path", default="samples", help="file path for the rotating (.ndjson) and columnar (.dcol) sinks")
+    parser.add_argument("--max-bytes", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--backups", type=int, default=5)
+    parser.add_argument("--fields", default=None, help="comma separated fields to keep")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    args = parser.parse_args(argv)
+
+    addresses = []
+    for arg in args.addresses:
+        ip, port = arg.split(":")
+        addresses.append((ip, int(port)))
+    sinks = []
+    for sink in args.sink or ["ndjson"]:
+        if sink == "ndjson":
+            sinks.append(NDJSONSink(sys.stdout))
+        elif sink == "rotating":
+            sinks.append(RotatingFileSink(args.path + ".ndjson", args.max_bytes, args.backups))
+        else:
+            sinks.append(ColumnarSink(args.path + ".dcol"))
+    stages = [select(args.fields.split(","))] if args.fields else []
+    collector = Collector(addresses, sinks, args.interval, stages=stages, queue_size=args.queue_size, batch_size=args.batch_size, flush_interval=args.flush_interval, serial_cache=SerialCache())
+    try:
+        asyncio.run(collector.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import select
+import threading
+import time
+from contextlib import contextmanager
+from transport_tcp import TransportTCP
+
+class ConnectionPool():
+	# Keeps TransportTCP connections open per (ip, port), so a long running
+	# collector pays the slow logger connect only once. Dead connections are
+	# detected before reuse, idle ones are closed after idle_timeout and
+	# connects are retried with exponential backoff.
+	
+	metrics = None
+
+	def __init__(self, max_per_logger=1, idle_timeout=60, retries=4, backoff=0.5, backoff_max=30, transport=TransportTCP, clock=time.monotonic, sleep=time.sleep):
+		self.max_per_logger = max_per_logger
+		self.idle_timeout = idle_timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.backoff_max = backoff_max
+		self.transport = transport
+		self.clock = clock
+		self.sleep = sleep
+		self.lock = threading.Condition()
+		self.idle = {}
+		self.open = {}
+
+	def acquire(self, ip, port, timeout=None):
+		key = (ip, port)
+		deadline = None if timeout is None else self.clock() + timeout
+		with self.lock:
+			self.evictIdle()
+			while True:
+				idle = self.idle.get(key)
+				while idle:
+					transport, last_used = idle.pop()
+					if self.healthy(transport):
+						return transport
+					self.discardLocked(key, transport)
+				if self.open.get(key, 0) < self.max_per_logger:
+					self.open[key] = self.open.get(key, 0) + 1
+					break
+				remaining = None if deadline is None else deadline - self.clock()
+				if remaining is not None and remaining <= 0:
+					raise TimeoutError(f"No free connection to {ip}:{port}")
+				self.lock.wait(remaining)
+		try:
+			return self.connect(key)
+		except BaseException:
+			with self.lock:
+				self.open[key] -= 1
+				self.lock.notify_all()
+			raise
+
+	def connect(self, key):
+		delay = self.backoff
+		for attempt in range(self.retries + 1):
+			transport = self.transport(*key)
+			try:
+				transport.start()
+				return transport
+			except OSError:
+				transport.stop()
+				if attempt == self.retries:
+					raise
+			if self.metrics is not None:
+				self.metrics.retries.inc()
+			self.sleep(delay)
+			delay = min(delay * 2, self.backoff_max)
+
+	def release(self, transport, broken=False):
+		key = (transport.ip, transport.port)
+		with self.lock:
+			if broken:
+				self.discardLocked(key, transport)
+			else:
+				self.idle.setdefault(key, []).append((transport, self.clock()))
+			self.lock.notify_all()
+
+	def discardLocked(self, key, transport):
+		transport.stop()
+		self.open[key] -= 1
+
+	@contextmanager
+	def connection(self, ip, port, timeout=None):
+		transport = self.acquire(ip, port, timeout)
+		try:
+			yield transport
+		except BaseException:
+			self.release(transport, broken=True)
+			raise
+		self.release(transport)
+
+	def send(self, ip, port, data, attempts=2):
+		# A dropped connection is replaced once before giving up
+		for attempt in range(attempts):
+			try:
+				with self.connection(ip, port) as transport:
+					response = transport.send(data)
+					if not response:
+						raise ConnectionError(f"{ip}:{port} closed the connection")
+					return response
+			except OSError:
+				if attempt == attempts - 1:
+					raise
+				if self.metrics is not None:
+					self.metrics.retries.inc()
+
+	@staticmethod
+	def healthy(transport):
+		# An idle connection is only reused when nothing is waiting on it:
+		# a readable socket is either closed or holds a late answer that the
+		# next send() would take for its own, and so do bytes left in the
+		# framer
+		if transport.s is None or transport.framer.pending():
+			return False
+		try:
+			readable, _, _ = select.select([transport.s], [], [], 0)
+			return not readable
+		except (OSError, ValueError):
+			return False
+
+	def evictIdle(self):
+		now = self.clock()
+		for key, idle in self.idle.items():
+			keep = []
+			for transport, last_used in idle:
+				if now - last_used > self.idle_timeout:
+					self.discardLocked(key, transport)
+				else:
+					keep.append((transport, last_used))
+			self.idle[key] = keep
+
+	def close(self):
+		with self.lock:
+			for key, idle in self.idle.items():
+				for transport, last_used in idle:
+					self.discardLocked(key, transport)
+			self.idle = {}
+			self.lock.notify_all()
@@ -0,0 +1,79 @@
+from deye import rModbusResponse, ModbusRequest, DeyeTCPResponse, FrameTemplate
+
+import struct
+
+
+class DeltaPoller:
+    # Keeps the last register block per inverter and, for every new block,
+    # decodes only the fields whose registers changed. Subscribers receive
+    # (key, {name: value}) for changed fields that moved at least their
+    # deadband away from the value last published.
+
+    def __init__(self, decoder=rModbusResponse.decoder, deadbands=None):
+        self.decoder = decoder
+        self.deadbands = deadbands or {}
+        self.registers = struct.Struct(f">{decoder.size // 2}H")
+        self.fieldsByRegister = [[] for i in range(self.registers.size // 2)]
+        for name, (offset, size) in decoder.index.items():
+            for reg in range(offset // 2, (offset + size + 1) // 2):
+                self.fieldsByRegister[reg].append(name)
+        self.last = {}
+        self.published = {}
+        self.subscribers = []
+
+    def subscribe(self, callback, fields=None):
+        subscription = (callback, None if fields is None else frozenset(fields))
+        self.subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.remove(subscription)
+
+    def changedFields(self, old, new):
+        if old == new:
+            return []
+        names = []
+        for reg, (a, b) in enumerate(zip(self.registers.unpack(old), self.registers.unpack(new))):
+            if a != b:
+                for name in self.fieldsByRegister[reg]:
+                    if name not in names:
+                        names.append(name)
+        return names
+
+    def block(self, frame):
+        DeyeTCPResponse.check(frame)
+        offset = DeyeTCPResponse.MODBUS_OFFSET
+        if frame[offset:offset + 2] != bytes.fromhex(ModbusRequest.DEYE_READ) or frame[offset + 2] < self.decoder.size:
+            raise ValueError("Not a full register block read response")
+        return bytes(frame[offset + 3:offset + 3 + self.decoder.size])
+
+    def update(self, key, frame):
+        block = self.block(frame)
+        old = self.last.get(key)
+        self.last[key] = block
+        names = list(self.decoder.index) if old is None else self.changedFields(old, block)
+        published = self.published.setdefault(key, {})
+        changes = {}
+        for name in names:
+            value = self.decoder.decodeField(block, name)
+            deadband = self.deadbands.get(name)
+            if deadband is not None and name in published and abs(value - published[name]) < deadband:
+                continue
+            if name in published and published[name] == value:
+                continue
+            changes[name] = value
+            published[name] = value
+        if changes:
+            for callback, fields in self.subscribers:
+                selected = changes if fields is None else {k: v for k, v in changes.items() if k in fields}
+                if selected:
+                    callback(key, selected)
+        return changes
+
+    def poll(self, transport, serial, key=None):
+        frame = transport.send(FrameTemplate.get(ModbusRequest.DEYE_READ, 0, self.decoder.size // 2, serial).stamp())
+        return self.update(key if key is not None else (transport.ip, transport.port), frame)
+
+    def forget(self, key):
+        self.last.pop(key, None)
+        self.published.pop(key, None)
@@ -1,17 +1,48 @@
 #!/bin/env python3
 
 from transport_tcp import *
-from bitstring import ConstBitStream, BitStream, Bits
+from checksum import modbusCRCBytes, frameChecksum, verifyFrameChecksum, verifyModbusCRC, MODBUS_MIN_LENGTH
 
 import sys
 import socket
-import libscrc
 import json
 import os
 import datetime
+import struct
+import functools
+import time
+import collections
+import threading
+import importlib
+from framing import FrameReader
+from registers import MICROINVERTER, MICROINVERTER_REGISTERS
 
 # END CONFIG
 
+class LazyModule:
+    # Imports the module on first attribute access, so importing deye for the
+    # compiled decoders does not pay for bitstring. import_module() holds the
+    # module's import lock, concurrent first uses wait for one complete load.
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attr)
+
+bitstring = sys.modules.get("bitstring") or LazyModule("bitstring")
+
+
+class FrameError(ValueError):
+    pass
+
+
+class ChecksumError(FrameError):
+    pass
+
+
 class InformationObj(object):
     name = ""
     description = ""
@@ -33,21 +64,32 @@ class InformationObj(object):
                 else:
                     self.value = v(data)
             self.rawdata = data[start:data.pos]
-        else:
-            if value >= self.val_min and value <= self.val_max:
-                self.value = value
-                self.update()
+        elif value is not None:
+            # Built for a write. The range is checked by RegisterWriter, which
+            # also takes bounds for parameters that have none.
+            for v in self.parsemap.values():
+                if not isinstance(v, str) and not isinstance(value, InformationObj):
+                    value = v(value=value)
+            self.value = value
+            self.update()
+
+    def inRange(self, value):
+        while isinstance(value, InformationObj):
+            value = value.value
+        return value >= self.val_min and value <= self.val_max
 
     def update(self):
-        bits = BitStream()
+        bits = bitstring.BitStream()
         for k,v in self.parsemap.items():
             if isinstance(v, str):
                 if "int" in v:
-                    bits.append(Bits(f"{v}={int(self.value)}"))
+                    bits.append(bitstring.Bits(f"{v}={int(self.value)}"))
+                elif v.startswith("bytes"):
+                    bits.append(bitstring.Bits(bytes=self.value))
                 else:
-                    bits.append(Bits(f"{v}={self.value}"))
+                    bits.append(bitstring.Bits(f"{v}={self.value}"))
             else:
-                bits.append(Bits(bytes=self.value.toBytes()))
+                bits.append(bitstring.Bits(bytes=self.value.toBytes()))
         self.rawdata = bits
 
     def update_recursive(self):
@@ -74,8 +116,9 @@ class InformationGroup(object):
     values = {}
 
     def __init__(self, rawbytes=None):
-        data = ConstBitStream(rawbytes)
+        data = bitstring.ConstBitStream(rawbytes)
         self.unparsed = bytes()
+        self.values = {}
         if data is not None:
             start = data.bytepos
             i = 0
@@ -92,18 +135,18 @@ class InformationGroup(object):
             self.rawdata = data.bytes[start:data.bytepos]
 
     def update(self):
-        bits = BitStream()
+        bits = bitstring.BitStream()
         i = 0
         for p in self.parsemap:
             if isinstance(p, str):
                 ident = f"UNPARSED_{i}"
-                bits.append(Bits(f"{p}={self.values[ident]}"))
+                bits.append(bitstring.Bits(f"{p}={self.values[ident]}"))
             else:
-                bits.append(Bits(self.values[p.name].toBits()))
+                bits.append(bitstring.Bits(self.values[p.name].toBits()))
             i+=1
         if "UNPARSED_REST" in self.values:
             rest = self.values["UNPARSED_REST"]
-            bits.append(Bits(f"bin={rest}"))
+            bits.append(bitstring.Bits(f"bin={rest}"))
         self.rawdata = bits.bytes
         
     def update_recursive(self):
@@ -114,6 +157,9 @@ class InformationGroup(object):
         
     def toBytes(self):
         return self.rawdata
+
+    def toBits(self):
+        return bitstring.Bits(bytes=self.rawdata)
         
     def __str__(self):
         out = ""
@@ -130,6 +176,7 @@ class InformationGroup(object):
 class NestedInformationGroup(InformationGroup):
     def __init__(self, data=None):
         self.unparsed = bytes()
+        self.values = {}
         if data is not None:
             start = data.bytepos
             i = 0
@@ -157,8 +204,8 @@ class FixedPNDecL(InformationObj):
             self.update()
             
     def update(self):
-        bits = BitStream()
-        bits.append(Bits(f"intbe:{self.length}={int(float(self.value)*self.divider):d}"))
+        bits = bitstring.BitStream()
+        bits.append(bitstring.Bits(f"intbe:{self.length}={int(float(self.value)*self.divider):d}"))
         self.rawdata = bits.bytes
         
     def update_recursive(self):
@@ -189,26 +236,30 @@ class FixedPTwoDec16(FixedPNDecL):
 
 class FixedPOneDec32(InformationObj):
     value = 0
+    divider = 10
 
     def __init__(self, data=None, value=None):
         if data is not None:
             start = data.bytepos
             low = data.read("intbe:16")
             high = data.read("intbe:16")
-            self.value = ((high << 16) + low) / 10
+            self.value = ((high << 16) + low) / self.divider
             self.rawdata = data.bytes[start:data.bytepos]
         else:
             self.value = value
             self.update()
             
     def update(self):
-        bits = BitStream()
-        val = int(float(self.value) * 10)
+        bits = bitstring.BitStream()
+        val = int(float(self.value) * self.divider)
         high = val >> 16
         low = val & 0x0000ffff
-        bits.append(Bits(f"intbe:16={low:d}"))
-        bits.append(Bits(f"intbe:16={high:d}"))
+        bits.append(bitstring.Bits(f"intbe:16={low:d}"))
+        bits.append(bitstring.Bits(f"intbe:16={high:d}"))
         self.rawdata = bits.bytes
+
+    def toBytes(self):
+        return self.rawdata
         
 
 class rDeyeStart(InformationObj):
@@ -256,273 +307,62 @@ class rModbusLength(InformationObj):
     description = ""
     parsemap = {"val":"uint:8"}
     
-class rModbusCRC(InformationObj):
-    name = "ModbusCRC"
-    description = ""
-    parsemap = {"val":"hex:16"}
-    
-class sDeviceType(InformationObj):
-    name = "sDeviceType"
+class rModbusStartReg(InformationObj):
+    name = "ModbusStartReg"
     description = ""
-    parsemap = {"val":"hex:16"}
-    
-class sModbusAddress(InformationObj):
-    name = "sModbusAddress"
-    description = ""
-    parsemap = {"val":"uintle:16"}
-    
-class sComProtoVersion(InformationObj):
-    name = "sComProtoVersion"
-    description = ""
-    parsemap = {"val":"bytes:2"}
+    parsemap = {"val":"uint:16"}
     
-class sSerial(InformationObj):
-    name = "sSerial"
-    description = ""
-    parsemap = {"val":"bytes:10"}
-
-class sRatedPower(InformationObj):
-    name = "sRatedPower"
+class rModbusRegCount(InformationObj):
+    name = "ModbusRegCount"
     description = ""
-    parsemap = {"val":FixedPOneDec32}
-    unit = "W"
+    parsemap = {"val":"uint:16"}
     
-class sNumMPPT(InformationObj):
-    name = "sNumMPPT"
+class rModbusException(InformationObj):
+    name = "ModbusException"
     description = ""
     parsemap = {"val":"uint:8"}
     
-class sNumPhases(InformationObj):
-    name = "sNumPhases"
-    description = ""
-    parsemap = {"val":"uint:8"}
-
-class pRatedGridVoltage(InformationObj):
-    name = "pRatedGridVoltage"
+class rModbusCRC(InformationObj):
+    name = "ModbusCRC"
     description = ""
     parsemap = {"val":"hex:16"}
-    
-class pRemoteLockEnabled(InformationObj):
-    name = "pRemoteLockEnabled"
-    description = ""
-    parsemap = {"val":"uint:16"}
-    
-class pPostTime(InformationObj):
-    name = "pPostTime"
-    description = ""
-    parsemap = {"val":"uint:16"}
-    unit = "s"
-    
-class pSystemTime(InformationObj):
-    name = "pSystemTime"
-    description = ""
-    parsemap = {"val":"hex:48"}
 
-class pGridVoltageUpperLimit(InformationObj):
-    name = "pGridVoltageUpperLimit"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "V"
-    
-class pGridVoltageLowerLimit(InformationObj):
-    name = "pGridVoltageLowerLimit"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "V"
-    
-class pGridFrequencyUpperLimit(InformationObj):
-    name = "pGridFrequencyUpperLimit"
-    description = ""
-    parsemap = {"val":FixedPTwoDec16}
-    unit = "Hz"
-    
-class pGridFrequencyLowerLimit(InformationObj):
-    name = "pGridFrequencyLowerLimit"
-    description = ""
-    parsemap = {"val":FixedPTwoDec16}
-    unit = "Hz"
-    
-class pGridCurrentUpperLimit(InformationObj):
-    name = "pGridCurrentUpperLimit"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "A"
 
-class pActivePowerRegulation(InformationObj):
-    name = "pActivePowerRegulation"
-    description = ""
-    parsemap = {"val":"uint:16"}
-    unit = "%"
-    
-class pSwitchEnable(InformationObj):
-    name = "pSwitchEnable"
-    description = ""
-    parsemap = {"val":"uint:16"}
-    
-class pFactoryResetEnable(InformationObj):
-    name = "pFactoryResetEnable"
-    description = ""
-    parsemap = {"val":"uint:16"}
-    
-class pSelfCheckingTimeIsland(InformationObj):
-    name = "pSelfCheckingTimeIsland"
-    description = ""
-    parsemap = {"val":"uint:16"}
-    unit = "s"
-    
-class pIslandProtectionEnable(InformationObj):
-    name = "pIslandProtectionEnable"
-    description = ""
-    parsemap = {"val":"uint:16"}
+FIXED_POINT = {(16, 10): FixedPOneDec16, (16, 100): FixedPTwoDec16}
+
+
+@functools.lru_cache(maxsize=None)
+def fixedPointClass(bits, scale, order):
+    if bits == 32 and order == "little":
+        if scale == 10:
+            return FixedPOneDec32
+        return type(f"FixedP{scale}Dec32", (FixedPOneDec32,), {"divider": scale})
+    return FIXED_POINT.get((bits, scale)) or type(f"FixedP{scale}Dec{bits}", (FixedPNDecL,), {"divider": scale, "length": bits})
+
+
+@functools.lru_cache(maxsize=None)
+def registerClass(register):
+    # Thin InformationObj subclass for a register table entry, used by the
+    # bitstring parser and to build write parameters
+    if register.scale is None:
+        fmt = register.type
+    else:
+        fmt = fixedPointClass(register.bits, register.scale, register.order)
+    return type(register.name, (InformationObj,), {
+        "__module__": __name__,
+        "name": register.name,
+        "description": "",
+        "parsemap": {"val": fmt},
+        "unit": register.unit,
+        "val_min": register.val_min,
+        "val_max": register.val_max,
+        "register": register,
+    })
+
+
+# sDeviceType, pGridVoltageUpperLimit, sModule3Current, ... by name
+globals().update((register.name, registerClass(register)) for register in MICROINVERTER)
 
-class sRunState(InformationObj):
-    name = "sRunState"
-    description = ""
-    parsemap = {"val":"uint:16"}
-    
-class sDayActivePower(InformationObj):
-    name = "sDayActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "kWh"
-    
-class sUptime(InformationObj):
-    name = "sUptime"
-    description = ""
-    parsemap = {"val":"uint:16"}
-    unit = "min"
-    
-class sTotalActivePower(InformationObj):
-    name = "sTotalActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec32}
-    unit = "kWh"
-    
-class sModule1DayActivePower(InformationObj):
-    name = "sModule1DayActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "kWh"
-    
-class sModule2DayActivePower(InformationObj):
-    name = "sModule2DayActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "kWh"
-    
-class sModule3DayActivePower(InformationObj):
-    name = "sModule3DayActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "kWh"
-    
-class sModule4DayActivePower(InformationObj):
-    name = "sModule4DayActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "kWh"
-    
-class sModule1TotalActivePower(InformationObj):
-    name = "sModule1TotalActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec32}
-    unit = "kWh"
-    
-class sModule2TotalActivePower(InformationObj):
-    name = "sModule2TotalActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec32}
-    unit = "kWh"
-    
-class sModule3TotalActivePower(InformationObj):
-    name = "sModule3TotalActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec32}
-    unit = "kWh"
-    
-class sModule4TotalActivePower(InformationObj):
-    name = "sModule4TotalActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec32}
-    unit = "kWh"
-    
-class sGridVoltage(InformationObj):
-    name = "sGridVoltage"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "V"
-    
-class sGridCurrent(InformationObj):
-    name = "sGridCurrent"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "A"
-    
-class sGridFrequency(InformationObj):
-    name = "sGridFrequency"
-    description = ""
-    parsemap = {"val":FixedPTwoDec16}
-    unit = "Hz"
-    
-class sActivePower(InformationObj):
-    name = "sActivePower"
-    description = ""
-    parsemap = {"val":FixedPOneDec32}
-    unit = "W"
-    
-class sTemperature(InformationObj):
-    name = "sTemperature"
-    description = ""
-    parsemap = {"val":FixedPTwoDec16}
-    unit = "°C"
-    
-class sModule1Voltage(InformationObj):
-    name = "sModule1Voltage"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "V"
-    
-class sModule2Voltage(InformationObj):
-    name = "sModule2Voltage"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "V"
-    
-class sModule3Voltage(InformationObj):
-    name = "sModule3Voltage"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "V"
-    
-class sModule4Voltage(InformationObj):
-    name = "sModule4Voltage"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "V"
-    
-class sModule1Current(InformationObj):
-    name = "sModule1Current"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "A"
-    
-class sModule2Current(InformationObj):
-    name = "sModule2Current"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "A"
-    
-class sModule3Current(InformationObj):
-    name = "sModule3Current"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "A"
-    
-class sModule4Current(InformationObj):
-    name = "sModule4Current"
-    description = ""
-    parsemap = {"val":FixedPOneDec16}
-    unit = "A"
 
 class ModbusRequest:
     DEYE_READ="0103"
@@ -536,9 +376,7 @@ class ModbusRequest:
         self.update()
         
     def genCRC(self):
-        modbus_crc=bytearray.fromhex("{:04x}".format(libscrc.modbus(self.rawbytes[0:6])))
-        modbus_crc.reverse()
-        return modbus_crc
+        return bytearray(modbusCRCBytes(self.rawbytes[0:6]))
 
     def update(self):
         self.rawbytes = bytearray.fromhex(F"{self.mode}{self.start_reg:04x}{self.count_reg:04x}")
@@ -550,26 +388,39 @@ class ModbusRequest:
         return self.rawbytes
 
 
+class FrameCounter:
+    # 16 bit frame number sequence that can be shared between threads
+    def __init__(self, start=0):
+        self.value = start & 0xffff
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            self.value = (self.value + 1) & 0xffff
+            return self.value
+
+
 class DeyeTCPRequest:
     START = bytearray.fromhex("A5")
     CONTROLCODE = bytearray.fromhex("1045")
     DATAFIELD = bytearray.fromhex("020000000000000000000000000000")
     END = bytearray.fromhex("15")
-    counter = 0
+    frames = FrameCounter()
 
     def __init__(self, modbus_frame, inverter_sn):
-        type(self).counter += 1
         self.modbus_frame = modbus_frame.toBytes()
         self.inverter_sn = int(inverter_sn).to_bytes(4, "little")
-        self.sn_prefix = int(type(self).counter).to_bytes(2, "big")
+        self.sn_prefix = int(type(self).nextCounter()).to_bytes(2, "big")
         
         self.update()
+
+    @classmethod
+    def nextCounter(cls):
+        # Frame numbers are 16 bit and wrap around
+        return cls.frames.next()
         
     def genCRC(self):
-        checksum = 0
-        for i in range(1, len(self.rawbytes) - 2, 1):
-            checksum += self.rawbytes[i] & 255
-        return int((checksum & 255))
+        return frameChecksum(self.rawbytes)
 
     def update(self):
         self.length = (13 + len(self.modbus_frame) + 2).to_bytes(2, "little")  # datalength
@@ -594,159 +445,257 @@ class DeyeTCPRequest:
     def toBytes(self):
         return self.rawbytes
 
+
+class ModbusWriteRequest(ModbusRequest):
+    # Write Multiple Registers (0x10) of the raw big endian register data
+
+    def __init__(self, start_reg, data):
+        self.data = bytes(data)
+        if len(self.data) % 2:
+            raise ValueError("Register data must be a whole number of registers")
+        super().__init__(ModbusRequest.DEYE_WRITE, start_reg, len(self.data) // 2)
+
+    def genCRC(self):
+        return bytearray(modbusCRCBytes(self.rawbytes))
+
+    def update(self):
+        self.rawbytes = bytearray.fromhex(F"{self.mode}{self.start_reg:04x}{self.count_reg:04x}{len(self.data):02x}") + self.data
+        self.rawbytes += self.genCRC()
+        
+        return self
+
+
+class FrameTemplate:
+    # A request frame built once per (mode, start_reg, count_reg, serial).
+    # stamp() only patches the frame number and checksum in the preallocated
+    # buffer and returns a memoryview of it, valid until the next stamp().
+    FRAMENUM = slice(5, 7)
+
+    def __init__(self, mode, start_reg, count_reg, inverter_sn):
+        self.buffer = bytearray(DeyeTCPRequest(ModbusRequest(mode, start_reg, count_reg), inverter_sn).toBytes())
+        self.base = frameChecksum(self.buffer) - sum(self.buffer[self.FRAMENUM])
+        self.view = memoryview(self.buffer)
+
+    def stamp(self, counter=None):
+        if counter is None:
+            counter = DeyeTCPRequest.nextCounter()
+        high = (counter >> 8) & 255
+        low = counter & 255
+        self.buffer[5] = high
+        self.buffer[6] = low
+        self.buffer[-2] = (self.base + high + low) & 255
+        return self.view
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def get(mode, start_reg, count_reg, inverter_sn):
+        return FrameTemplate(mode, start_reg, count_reg, inverter_sn)
+
+
+class ModbusDecoder:
+    # Compiles a register table into one big-endian struct format and a
+    # generated decode function that builds the value dict in one
+    # expression, so a whole block is unpacked in a single call without a
+    # per-field loop. Gaps between registers are skipped, not decoded.
+    # parsemap holds the matching register classes and padding for the
+    # bitstring parser.
+
+    def __init__(self, registers, count=None):
+        self.registers = {register.name: register for register in registers}
+        self.parsemap = []
+        self.fields = []
+        self.index = {}
+        self.lookup = {}
+        self.fieldStructs = {}
+        self.encoders = {}
+        fmt = ">"
+        exprs = []
+        offset = 0
+        slot = 0
+        for register in sorted(registers, key=lambda register: register.offset):
+            if register.offset < offset:
+                raise ValueError(f"{register.name} overlaps the previous register")
+            fmt += self.pad(register.offset - offset)
+            offset = register.offset
+            code, size, nslots, expr = self.compileField(register)
+            fmt += code
+            self.parsemap.append(registerClass(register))
+            self.fields.append((register.name, slot, nslots))
+            self.lookup[register.name] = (slot, nslots, self.compileConverter(register, slot))
+            self.fieldStructs[register.name] = (struct.Struct(">" + code), offset, self.compileConverter(register, 0))
+            self.index[register.name] = (offset, size)
+            self.encoders[register.name] = self.compileEncoder(register)
+            exprs.append(f"{register.name!r}: {expr(slot)}")
+            offset += size
+            slot += nslots
+        if count is not None:
+            fmt += self.pad(count * 2 - offset)
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+        namespace = {"unpack_from": self.struct.unpack_from, "from_bytes": int.from_bytes}
+        exec(f"def values(v):\n    return {{{', '.join(exprs)}}}", namespace)
+        exec("def decode(block, offset=0):\n    return values(unpack_from(block, offset))", namespace)
+        self.values = namespace["values"]
+        self.decode = namespace["decode"]
+
+    def pad(self, size):
+        if size < 0:
+            raise ValueError("Register table is longer than the block")
+        self.parsemap += ["hex:16"] * (size // 2) + ["hex:8"] * (size % 2)
+        return f"{size}x" if size else ""
+
+    @staticmethod
+    def fmtBits(fmt):
+        return int(fmt.split(":")[1])
+
+    @staticmethod
+    def compileField(register):
+        # Returns the struct code, byte size, number of unpacked values and
+        # a function giving the value expression for its first slot
+        kind, bits, size, scale = register.kind, register.bits, register.size, register.scale
+        if kind == "hex":
+            return f"{size}s", size, 1, lambda s: f"v[{s}].hex()"
+        if kind == "bytes":
+            return f"{size}s", size, 1, lambda s: f"v[{s}]"
+        signed = not kind.startswith("u")
+        if kind.endswith("le"):
+            code, nslots = f"{size}s", 1
+            expr = lambda s: f"from_bytes(v[{s}], 'little', signed={signed})"
+        elif bits == 32 and register.order == "little":
+            # Low word first, both words signed as the inverter sends them
+            code, nslots = "hh" if signed else "HH", 2
+            expr = lambda s: f"((v[{s + 1}] << 16) + v[{s}])"
+        else:
+            code, nslots = {8: "b", 16: "h", 32: "i"}[bits], 1
+            code = code if signed else code.upper()
+            expr = lambda s: f"v[{s}]"
+        if scale is None:
+            return code, size, nslots, expr
+        return code, size, nslots, lambda s: f"{expr(s)} / {scale}"
+
+    @staticmethod
+    def compileConverter(register, slot):
+        # The same conversion as the generated expression, as a closure over
+        # the unpacked values so it needs no compile at import
+        kind, scale = register.kind, register.scale
+        if kind == "hex":
+            return lambda v: v[slot].hex()
+        if kind == "bytes":
+            return lambda v: v[slot]
+        signed = not kind.startswith("u")
+        if kind.endswith("le"):
+            raw = lambda v: int.from_bytes(v[slot], "little", signed=signed)
+        elif register.bits == 32 and register.order == "little":
+            raw = lambda v: (v[slot + 1] << 16) + v[slot]
+        elif scale is None:
+            return lambda v: v[slot]
+        else:
+            return lambda v: v[slot] / scale
+        if scale is None:
+            return raw
+        return lambda v: raw(v) / scale
+
+    @staticmethod
+    def compileEncoder(register):
+        kind, bits, size, scale = register.kind, register.bits, register.size, register.scale
+        if kind == "hex":
+            return bytes.fromhex
+        if kind == "bytes":
+            return bytes
+        signed = not kind.startswith("u")
+        order = "little" if kind.endswith("le") else "big"
+        raw = (lambda value: round(float(value) * scale)) if scale is not None else int
+        if bits == 32 and register.order == "little":
+            if not signed:
+                return lambda value: (raw(value) & 0xffff).to_bytes(2, "big") + (raw(value) >> 16).to_bytes(2, "big")
+            # Both words are decoded signed, so the high word absorbs the
+            # sign of the low one
+            def encode(value):
+                value = raw(value)
+                low = ((value & 0xffff) ^ 0x8000) - 0x8000
+                return low.to_bytes(2, "big", signed=True) + ((value - low) >> 16).to_bytes(2, "big", signed=True)
+            return encode
+        return lambda value: raw(value).to_bytes(size, order, signed=signed)
+
+    def encode(self, name, value):
+        # Register bytes of one field, the inverse of decodeField
+        data = self.encoders[name](value)
+        if len(data) != self.index[name][1]:
+            raise ValueError(f"{name} takes {self.index[name][1]} bytes, got {len(data)}")
+        return data
+
+    def convert(self, vals, name):
+        return self.lookup[name][2](vals)
+
+    def decodeField(self, block, name, offset=0, length=None):
+        fstruct, start, conv = self.fieldStructs[name]
+        if length is not None and start + fstruct.size > length:
+            raise ValueError(f"{name} is not in the {length} byte register block")
+        return conv(fstruct.unpack_from(block, offset + start))
+
+    def unpackFrame(self, frame):
+        data = memoryview(frame)
+        if bytes(data[DeyeTCPResponse.MODBUS_OFFSET:DeyeTCPResponse.MODBUS_OFFSET + 2]) != bytes.fromhex(ModbusRequest.DEYE_READ):
+            raise ValueError("Not a Modbus read response")
+        if data[DeyeTCPResponse.MODBUS_OFFSET + 2] < self.size:
+            raise ValueError(f"Register block shorter than {self.size} bytes")
+        return self.struct.unpack_from(data, DeyeTCPResponse.MODBUS_OFFSET + 3)
+
+    def decodeFrame(self, frame):
+        data = memoryview(frame)
+        self.unpackFrame(data)
+        return self.decode(data, DeyeTCPResponse.MODBUS_OFFSET + 3)
+
+
 class rModbusResponse(NestedInformationGroup):
     name = "ModbusResponse"
     description = "Modbus Response Frame"
     parsemap = [rModbusCommand]
     values = {}
     
-    modbus_parsemap = [
-        sDeviceType,                                  # 000
-        sModbusAddress,                               # 001   
-        sComProtoVersion,                             # 002
-        sSerial,                                      # 003
-                                                      # 004
-                                                      # 005
-                                                      # 006
-                                                      # 007
-        "hex:16",                                     # 008
-        "hex:16",                                     # 009
-        "hex:16",                                     # 010
-        "hex:16",                                     # 011
-        "hex:16",                                     # 012
-        "hex:16",                                     # 013
-        "hex:16",                                     # 014
-        "hex:16",                                     # 015
-        sRatedPower,                                  # 016
-                                                      # 017
-        sNumMPPT, sNumPhases,                         # 018
-        pRatedGridVoltage,                            # 019
-        pRemoteLockEnabled,                           # 020
-        pPostTime,                                    # 021
-        pSystemTime,                                  # 022
-                                                      # 023
-                                                      # 024
-        "hex:16",                                     # 025
-        "hex:16",                                     # 026
-        pGridVoltageUpperLimit,                       # 027
-        pGridVoltageLowerLimit,                       # 028
-        pGridFrequencyUpperLimit,                     # 029
-        pGridFrequencyLowerLimit,                     # 030
-        pGridCurrentUpperLimit,                       # 031
-        "hex:16",                                     # 032
-        "hex:16",                                     # 033
-        "hex:16",                                     # 034
-        "hex:16",                                     # 035
-        "hex:16",                                     # 036
-        "hex:16",                                     # 037
-        "hex:16",                                     # 038
-        "hex:16",                                     # 039
-        pActivePowerRegulation,                       # 040
-        "hex:16",                                     # 041
-        "hex:16",                                     # 042
-        pSwitchEnable,                                # 043
-        pFactoryResetEnable,                          # 044
-        pSelfCheckingTimeIsland,                      # 045
-        pIslandProtectionEnable,                      # 046
-        "hex:16",                                     # 047
-        "hex:16",                                     # 048
-        "hex:16",                                     # 049
-        "hex:16",                                     # 050
-        "hex:16",                                     # 051
-        "hex:16",                                     # 052
-        "hex:16",                                     # 053
-        "hex:16",                                     # 054
-        "hex:16",                                     # 055
-        "hex:16",                                     # 056
-        "hex:16",                                     # 057
-        "hex:16",                                     # 058
-        sRunState,                                    # 059
-        sDayActivePower,                              # 060
-        "hex:16",                                     # 061
-        sUptime,                                      # 062
-        sTotalActivePower,                            # 063
-                                                      # 064
-        sModule1DayActivePower,                       # 065
-        sModule2DayActivePower,                       # 066
-        sModule3DayActivePower,                       # 067
-        sModule4DayActivePower,                       # 068
-        sModule1TotalActivePower,                     # 069
-                                                      # 070
-        sModule2TotalActivePower,                     # 071
-                                                      # 072
-        sGridVoltage,                                 # 073
-        sModule3TotalActivePower,                     # 074
-                                                      # 075
-        sGridCurrent,                                 # 076
-        sModule4TotalActivePower,                     # 077
-                                                      # 078
-        sGridFrequency,                               # 079
-        "hex:16",                                     # 080
-        "hex:16",                                     # 081
-        "hex:16",                                     # 082
-        "hex:16",                                     # 083
-        "hex:16",                                     # 084
-        "hex:16",                                     # 085
-        sActivePower,                                 # 086
-                                                      # 087
-        "hex:16",                                     # 088
-        "hex:16",                                     # 089
-        sTemperature,                                 # 090
-        "hex:16",                                     # 091
-        "hex:16",                                     # 092
-        "hex:16",                                     # 093
-        "hex:16",                                     # 094
-        "hex:16",                                     # 095
-        "hex:16",                                     # 096
-        "hex:16",                                     # 097
-        "hex:16",                                     # 098
-        "hex:16",                                     # 099
-        "hex:16",                                     # 100
-        "hex:16",                                     # 101
-        "hex:16",                                     # 102
-        "hex:16",                                     # 103
-        "hex:16",                                     # 104
-        "hex:16",                                     # 105
-        "hex:16",                                     # 106
-        "hex:16",                                     # 107
-        "hex:16",                                     # 108
-        sModule1Voltage,                              # 109
-        sModule1Current,                              # 110
-        sModule2Voltage,                              # 111
-        sModule2Current,                              # 112
-        sModule3Voltage,                              # 113
-        sModule3Current,                              # 114
-        sModule4Voltage,                              # 115
-        sModule4Current,                              # 116
-        "hex:16",                                     # 117
-        "hex:16",                                     # 118
-        "hex:16"                                      # 119
-        ]                                       
+    decoder = ModbusDecoder(MICROINVERTER, MICROINVERTER_REGISTERS)
+    modbus_parsemap = decoder.parsemap
+
+    # Fixed parse plans, picked per instance once command and length are known
+    read_header_parsemap = [rModbusCommand, rModbusLength]
+    read_parsemap = read_header_parsemap + modbus_parsemap + [rModbusCRC]
+    empty_read_parsemap = read_header_parsemap + [rModbusCRC]
+    write_parsemap = [rModbusCommand, rModbusStartReg, rModbusRegCount, rModbusCRC]
+    exception_parsemap = [rModbusCommand, rModbusException, rModbusCRC]
                                                       
     def __init__(self, data=None):                    
         self.unparsed = bytes()                       
+        self.values = {}
         if data is not None:
             start = data.bytepos
             i = 0
-            for p in self.parsemap:
+            while i < len(self.parsemap):
+                p = self.parsemap[i]
                 try:
                     if isinstance(p, str):
                         pad = data.read(p)
                         self.values[f"UNPARSED_{i}"] = pad
                     else:
                         self.values[p.name] = p(data)
-                except:
-                    pass
+                except Exception:
+                    if DeyeTCPResponse.metrics is not None:
+                        DeyeTCPResponse.metrics.parse_errors.inc(field="padding" if isinstance(p, str) else p.name)
                 
                 if i==0:
-                    if self.values[p.name].value == ModbusRequest.DEYE_READ:
-                        self.parsemap.append(rModbusLength)
-
-                if i==1:
+                    command = self.values[p.name].value
+                    if command == ModbusRequest.DEYE_READ:
+                        self.parsemap = self.read_header_parsemap
+                    elif command == ModbusRequest.DEYE_WRITE:
+                        self.parsemap = self.write_parsemap
+                    elif len(command) == 4 and int(command[2:], 16) & 0x80:
+                        self.parsemap = self.exception_parsemap
+
+                if i==1 and self.parsemap is self.read_header_parsemap:
                     self.length = self.values[p.name].value
                     if self.length > 0:
-                        self.parsemap += self.modbus_parsemap
-                    self.parsemap.append(rModbusCRC)
+                        self.parsemap = self.read_parsemap
+                    else:
+                        self.parsemap = self.empty_read_parsemap
                     
                 i+=1
                     
@@ -758,28 +707,290 @@ class DeyeTCPResponse(InformationGroup):
     parsemap = [rDeyeStart, rLength, rControlCode, rFrameNum, rInvSerial, "hex:112", rModbusResponse, rDeyeCRC, rDeyeEnd]
     values = {}
 
+    MODBUS_OFFSET = 25
+    START = 0xa5
+    END = 0x15
+
+    @classmethod
+    def validate(cls, frame):
+        if len(frame) < 13:
+            raise FrameError(f"Frame too short: {len(frame)} bytes")
+        if frame[0] != cls.START:
+            raise FrameError(f"Bad start byte {frame[0]:02x}")
+        length = int.from_bytes(frame[1:3], "little")
+        if length + 13 != len(frame):
+            raise FrameError(f"Length field {length} does not match {len(frame)} byte frame")
+        if frame[-1] != cls.END:
+            raise FrameError(f"Bad end byte {frame[-1]:02x}")
+        if not verifyFrameChecksum(frame):
+            raise ChecksumError(f"Bad frame checksum {frame[-2]:02x}, expected {frameChecksum(frame):02x}")
+        # Logger error replies carry no Modbus frame
+        modbus = memoryview(frame)[cls.MODBUS_OFFSET:-2]
+        if len(modbus) >= MODBUS_MIN_LENGTH and not verifyModbusCRC(modbus):
+            raise ChecksumError(f"Bad Modbus CRC {bytes(modbus[-2:]).hex()}")
+
+    metrics = None
+
+    @classmethod
+    def check(cls, frame):
+        # validate() that counts rejected frames while metrics are installed
+        metrics = cls.metrics
+        if metrics is None:
+            cls.validate(frame)
+            return
+        try:
+            cls.validate(frame)
+        except ChecksumError:
+            metrics.crc_failures.inc()
+            raise
+        except FrameError:
+            metrics.frame_errors.inc()
+            raise
+
+    def __init__(self, rawbytes=None):
+        if rawbytes is None:
+            super().__init__(rawbytes)
+        elif self.metrics is None:
+            self.validate(rawbytes)
+            super().__init__(rawbytes)
+        else:
+            self.initInstrumented(rawbytes)
+
+    def initInstrumented(self, rawbytes):
+        metrics = self.metrics
+        start = time.perf_counter()
+        self.check(rawbytes)
+        try:
+            super().__init__(rawbytes)
+        except Exception:
+            metrics.parse_errors.inc(field=self.name)
+            raise
+        metrics.decode.observe(time.perf_counter() - start)
+
+    @classmethod
+    def lazy(cls, frame):
+        return LazyDeyeTCPResponse(frame)
+
+
+class DeyeTCPResult:
+    # Read-only view of a response frame. The frame is kept once, the register
+    # block is unpacked into a single tuple on first access and values are
+    # converted by name through rModbusResponse.decoder. Use editable() for the
+    # InformationObj tree needed to re-serialize values for writes.
+    __slots__ = ("frame", "_vals")
+
+    decoder = rModbusResponse.decoder
+
+    def __init__(self, frame):
+        self.frame = bytes(frame)
+        self._vals = None
+        DeyeTCPResponse.check(self.frame)
+
+    def _unpacked(self):
+        if self._vals is None:
+            self._vals = self.decoder.unpackFrame(self.frame)
+        return self._vals
+
+    @property
+    def frameNum(self):
+        return int.from_bytes(self.frame[5:7], "big")
+
+    @property
+    def invSerial(self):
+        return int.from_bytes(self.frame[7:11], "little")
+
+    def __getitem__(self, name):
+        return self.decoder.convert(self._unpacked(), name)
+
+    def get(self, name, default=None):
+        if name not in self.decoder.lookup:
+            return default
+        return self[name]
+
+    def __contains__(self, name):
+        return name in self.decoder.lookup
+
+    def __iter__(self):
+        return iter(self.decoder.lookup)
+
+    def keys(self):
+        return self.decoder.lookup.keys()
+
+    def items(self):
+        return list(self.decoder.values(self._unpacked()).items())
+
+    def toDict(self):
+        return self.decoder.decodeFrame(self.frame)
+
+    def editable(self):
+        return DeyeTCPResponse(self.frame)
+
+    def __json__(self):
+        return self.toDict()
+
+
+class LazyDeyeTCPResponse(DeyeTCPResult):
+    # Validates the frame envelope up front, then decodes each register only
+    # when it is first read and keeps the result.
+    __slots__ = ("_cache", "_length")
+
+    def __init__(self, frame):
+        super().__init__(frame)
+        self._cache = {}
+        self._length = None
+
+    def _blockLength(self):
+        if self._length is None:
+            offset = DeyeTCPResponse.MODBUS_OFFSET
+            if self.frame[offset:offset + 2] != bytes.fromhex(ModbusRequest.DEYE_READ):
+                raise ValueError("Not a Modbus read response")
+            self._length = self.frame[offset + 2]
+        return self._length
+
+    def __getitem__(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            value = self.decoder.decodeField(self.frame, name, DeyeTCPResponse.MODBUS_OFFSET + 3, self._blockLength())
+            self._cache[name] = value
+            return value
+
+    def items(self):
+        return [(name, self[name]) for name in self.decoder.lookup]
+
+
+def plainValue(value):
+    while isinstance(value, InformationObj):
+        value = value.value
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+def decodeRecord(frame):
+    try:
+        response = DeyeTCPResponse(frame)
+        record = {
+            "FrameNum": response.values["FrameNum"].value,
+            "InvSerial": response.values["InvSerial"].value,
+        }
+        for k, v in response.values["ModbusResponse"].values.items():
+            if "UNPARSED" not in k:
+                record[k] = plainValue(v)
+        return record
+    except Exception as e:
+        return {"error": repr(e)}
+
+
+def decodeChunk(frames):
+    return [decodeRecord(frame) for frame in frames]
+
+
+def readFrames(f):
+    # Archives are either the hex lines main() prints or concatenated raw frames
+    first = f.peek(1)[:1]
+    if first == bytes([DeyeTCPResponse.START]):
+        framer = FrameReader()
+        for data in iter(lambda: f.read(65536), b""):
+            framer.feed(data)
+            yield from framer.frames()
+    else:
+        # Anything else main() prints, such as the connect message and the
+        # field dump, is skipped
+        for line in f:
+            try:
+                frame = bytes.fromhex(line.decode())
+            except ValueError:
+                continue
+            if frame[:1] == bytes([DeyeTCPResponse.START]):
+                yield frame
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def replay(path, out=sys.stdout, fmt="ndjson", workers=None, chunksize=256):
+    # Decodes an archive with DeyeTCPResponse on a process pool and writes the
+    # records in input order. At most 2 chunks per worker are in flight.
+    if fmt == "csv":
+        import csv
+        fields = ["FrameNum", "InvSerial", rModbusCommand.name, rModbusLength.name] + list(rModbusResponse.decoder.lookup) + [rModbusCRC.name, "error"]
+        writer = csv.DictWriter(out, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda record: out.write(json.dumps(record) + "\n")
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    window = 2 * workers
+    count = 0
+    with open(path, "rb") as f, ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for chunk in chunked(readFrames(f), chunksize):
+            pending.append(pool.submit(decodeChunk, chunk))
+            while len(pending) >= window:
+                for record in pending.popleft().result():
+                    write(record)
+                    count += 1
+        while pending:
+            for record in pending.popleft().result():
+                write(record)
+                count += 1
+    return count
+
 
 def main():
-    if len(sys.argv) == 2 and ":" in sys.argv[1]:
+    if len(sys.argv) >= 3 and sys.argv[1] == "replay":
+        import argparse
+        parser = argparse.ArgumentParser(prog="deye.py replay")
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+        parser.add_argument("--workers", type=int, default=None)
+        parser.add_argument("--chunk-size", type=int, default=256)
+        args = parser.parse_args(sys.argv[2:])
+        replay(args.path, sys.stdout, args.format, args.workers, args.chunk_size)
+    elif len(sys.argv) >= 3 and sys.argv[1] == "collect":
+        from collector import main as collect
+        collect(sys.argv[2:])
+    elif len(sys.argv) == 2 and ":" in sys.argv[1]:
         ip,port = sys.argv[1].split(":")
         tcp = TransportTCP(ip, int(port))
         tcp.start()
 
-        frame_bytes = DeyeTCPRequest(ModbusRequest(ModbusRequest.DEYE_READ, 0, 1), "0000000000").toBytes()
-        response = tcp.send(frame_bytes)
-        deyeTCPResponse = DeyeTCPResponse(response)
-        invSerial = deyeTCPResponse.values["InvSerial"].value
+        from discovery import SerialCache
+        cache = SerialCache()
+        invSerial = cache.get(ip, port)
+        if invSerial is None:
+            frame_bytes = DeyeTCPRequest(ModbusRequest(ModbusRequest.DEYE_READ, 0, 1), "0000000000").toBytes()
+            response = tcp.send(frame_bytes)
+            deyeTCPResponse = DeyeTCPResponse(response)
+            invSerial = deyeTCPResponse.values["InvSerial"].value
+            cache.put(ip, port, invSerial)
         print(F"[+] Connected to Inverter with Serial: {invSerial}")
         
 
         frame_bytes = DeyeTCPRequest(ModbusRequest(ModbusRequest.DEYE_READ, 0, 120), invSerial).toBytes()
         response = tcp.send(frame_bytes)
-        print(response.hex())
         deyeTCPResponse = DeyeTCPResponse(response)
+        if not cache.check(ip, port, invSerial, deyeTCPResponse.values["InvSerial"].value):
+            invSerial = deyeTCPResponse.values["InvSerial"].value
+            print(F"[+] Inverter Serial changed to: {invSerial}")
+            frame_bytes = DeyeTCPRequest(ModbusRequest(ModbusRequest.DEYE_READ, 0, 120), invSerial).toBytes()
+            response = tcp.send(frame_bytes)
+            deyeTCPResponse = DeyeTCPResponse(response)
+        print(response.hex())
         deyeTCPResponse.values["ModbusResponse"].values = {k: v for k, v in deyeTCPResponse.values["ModbusResponse"].values.items() if "UNPARSED" not in k and "3" not in k and "4" not in k}
         print(deyeTCPResponse.values["ModbusResponse"])
     else:
-        print("Usage: ./deye.py ip:port\nPort is likely 8899")
+        print("Usage: ./deye.py ip:port\nPort is likely 8899\n       ./deye.py replay archive [--format ndjson|csv] [--workers N] [--chunk-size N]\n       ./deye.py collect ip:port [ip:port ...] [--interval S] [--sink ndjson|rotating|columnar] [--path P]")
 
 if __name__ == '__main__':
     main()
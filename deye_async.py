@@ -0,0 +1,121 @@
+#!/bin/env python3
+
+from deye import DeyeTCPRequest, DeyeTCPResponse, FrameError, ModbusRequest
+from transport_tcp_async import AsyncTransportTCP
+from discovery import SerialCache
+from writer import RegisterWriter
+
+import sys
+import asyncio
+
+
+class AsyncDeyeClient:
+    PROBE_SERIAL = "0000000000"
+
+    def __init__(self, ip, port, serial=None, timeout=5, serial_cache=None):
+        self.ip = ip
+        self.port = port
+        self.serial = serial
+        self.serial_cache = serial_cache
+        if serial is None and serial_cache is not None:
+            self.serial = serial_cache.get(ip, port)
+        self.timeout = timeout
+        self.transport = AsyncTransportTCP(ip, port, timeout)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        await self.transport.start()
+
+    async def close(self):
+        await self.transport.stop()
+
+    async def request(self, modbus_frame, serial=None):
+        if serial is None:
+            serial = self.serial
+        frame_bytes = DeyeTCPRequest(modbus_frame, serial).toBytes()
+        response = await asyncio.wait_for(self.transport.send(frame_bytes), self.timeout)
+        return DeyeTCPResponse(response)
+
+    async def discover(self):
+        response = await self.request(ModbusRequest(ModbusRequest.DEYE_READ, 0, 1), self.PROBE_SERIAL)
+        self.serial = response.values["InvSerial"].value
+        if self.serial_cache is not None:
+            self.serial_cache.put(self.ip, self.port, self.serial)
+        return self.serial
+
+    async def read(self, start_reg=0, count_reg=120):
+        if self.serial is None:
+            await self.discover()
+        response = await self.request(ModbusRequest(ModbusRequest.DEYE_READ, start_reg, count_reg))
+        if self.serial_cache is not None and not self.serial_cache.check(self.ip, self.port, self.serial, response.values["InvSerial"].value):
+            self.serial = response.values["InvSerial"].value
+            response = await self.request(ModbusRequest(ModbusRequest.DEYE_READ, start_reg, count_reg))
+        return response
+
+
+    async def write(self, params, writer=None):
+        writer = writer or RegisterWriter()
+        requests = writer.requests(params)
+        if self.serial is None:
+            await self.discover()
+        return [writer.checkAck(request, await self.request(request)) for request in requests]
+
+
+async def pollFleet(addresses, start_reg=0, count_reg=120, concurrency=100, timeout=5, serial_cache=None):
+    # Polls every (ip, port) with at most `concurrency` open sessions. Failed
+    # polls yield their exception in place of a response.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def poll(ip, port):
+        async with semaphore:
+            try:
+                async with AsyncDeyeClient(ip, port, timeout=timeout, serial_cache=serial_cache) as client:
+                    return await client.read(start_reg, count_reg)
+            except (OSError, asyncio.TimeoutError, FrameError) as e:
+                return e
+
+    return await asyncio.gather(*(poll(ip, port) for ip, port in addresses))
+
+
+async def writeFleet(addresses, params, concurrency=100, timeout=5, serial_cache=None, writer=None):
+    # Applies the same parameter objects to every (ip, port). The requests are
+    # validated once up front, failed writes yield their exception.
+    writer = writer or RegisterWriter()
+    writer.plan(params)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def write(ip, port):
+        async with semaphore:
+            try:
+                async with AsyncDeyeClient(ip, port, timeout=timeout, serial_cache=serial_cache) as client:
+                    return await client.write(params, writer)
+            except (OSError, asyncio.TimeoutError, ValueError, RuntimeError) as e:
+                return e
+
+    return await asyncio.gather(*(write(ip, port) for ip, port in addresses))
+
+
+def main():
+    if len(sys.argv) >= 2 and all(":" in arg for arg in sys.argv[1:]):
+        addresses = []
+        for arg in sys.argv[1:]:
+            ip, port = arg.split(":")
+            addresses.append((ip, int(port)))
+        responses = asyncio.run(pollFleet(addresses, serial_cache=SerialCache()))
+        for (ip, port), response in zip(addresses, responses):
+            if isinstance(response, Exception):
+                print(f"[-] {ip}:{port}: {response!r}")
+            else:
+                print(f"[+] {ip}:{port} Serial: {response.values['InvSerial'].value}")
+                print(response.values["ModbusResponse"])
+    else:
+        print("Usage: ./deye_async.py ip:port [ip:port ...]\nPort is likely 8899")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import json
+import os
+import time
+import tempfile
+import threading
+
+
+class SerialCache:
+    # Persistent map of logger address to inverter serial, so steady state
+    # polls skip the probe request. Entries expire after ttl seconds and are
+    # replaced when a response reports a different rInvSerial. Safe to share
+    # between threads.
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "deye", "serials.json")
+
+    def __init__(self, path=DEFAULT_PATH, ttl=7 * 24 * 3600, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.load()
+
+    @staticmethod
+    def key(ip, port):
+        return f"{ip}:{port}"
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def get(self, ip, port):
+        with self.lock:
+            entry = self.entries.get(self.key(ip, port))
+            if entry is None:
+                return None
+            if self.clock() - entry["time"] > self.ttl:
+                self.invalidate(ip, port)
+                return None
+            return entry["serial"]
+
+    def put(self, ip, port, serial):
+        with self.lock:
+            self.entries[self.key(ip, port)] = {"serial": serial, "time": self.clock()}
+            self.save()
+
+    def invalidate(self, ip, port):
+        with self.lock:
+            if self.entries.pop(self.key(ip, port), None) is not None:
+                self.save()
+
+    def check(self, ip, port, serial, response_serial):
+        # Returns True if the serial used for a request was the right one
+        if response_serial == serial:
+            return True
+        with self.lock:
+            self.invalidate(ip, port)
+            if response_serial:
+                self.put(ip, port, response_serial)
+        return False
@@ -0,0 +1,170 @@
+#!/bin/env python3
+
+from deye import DeyeTCPRequest, DeyeTCPResponse, DeyeTCPResult, ModbusRequest
+from connection_pool import ConnectionPool
+from discovery import SerialCache
+from writer import RegisterWriter
+
+import sys
+import threading
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+
+class Lane:
+    # Jobs for one logger, run one after another. A lane occupies a worker
+    # thread only while it has jobs queued.
+    def __init__(self, ip, port, serial=None):
+        self.ip = ip
+        self.port = port
+        self.serial = serial
+        self.jobs = collections.deque()
+        self.running = False
+
+
+class FleetPoller:
+    # Polls many loggers from a thread pool for callers that cannot use
+    # asyncio. Every logger gets a lane so it never sees two sessions at
+    # once, while different loggers run in parallel on up to max_workers
+    # threads; a fleet poll then takes about as long as its slowest logger.
+    # All methods are thread-safe and return futures.
+    PROBE_SERIAL = "0000000000"
+
+    def __init__(self, max_workers=32, decode=DeyeTCPResult, serial_cache=None, pool=None):
+        self.decode = decode
+        self.serial_cache = serial_cache
+        self.pool = pool or ConnectionPool(max_per_logger=1)
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="FleetPoller")
+        self.lock = threading.Lock()
+        self.lanes = {}
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lane(self, ip, port):
+        with self.lock:
+            lane = self.lanes.get((ip, port))
+            if lane is None:
+                serial = None if self.serial_cache is None else self.serial_cache.get(ip, port)
+                lane = self.lanes[(ip, port)] = Lane(ip, port, serial)
+            return lane
+
+    def submit(self, ip, port, fn, *args):
+        # Runs fn(lane, *args) in the lane of (ip, port) after the jobs
+        # already queued there
+        lane = self.lane(ip, port)
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("FleetPoller is closed")
+            lane.jobs.append((future, fn, args))
+            if lane.running:
+                return future
+            lane.running = True
+        self.executor.submit(self.drain, lane)
+        return future
+
+    def drain(self, lane):
+        while True:
+            with self.lock:
+                if not lane.jobs:
+                    lane.running = False
+                    return
+                future, fn, args = lane.jobs.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(lane, *args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def request(self, lane, modbus_frame, serial=None):
+        frame = DeyeTCPRequest(modbus_frame, lane.serial if serial is None else serial).toBytes()
+        response = self.pool.send(lane.ip, lane.port, frame)
+        DeyeTCPResponse.check(response)
+        return response
+
+    def discover(self, lane):
+        response = self.request(lane, ModbusRequest(ModbusRequest.DEYE_READ, 0, 1), self.PROBE_SERIAL)
+        lane.serial = int.from_bytes(response[7:11], "little")
+        if self.serial_cache is not None:
+            self.serial_cache.put(lane.ip, lane.port, lane.serial)
+        return lane.serial
+
+    def readLane(self, lane, start_reg, count_reg):
+        if lane.serial is None:
+            self.discover(lane)
+        request = ModbusRequest(ModbusRequest.DEYE_READ, start_reg, count_reg)
+        response = self.request(lane, request)
+        serial = int.from_bytes(response[7:11], "little")
+        if serial != lane.serial:
+            # The logger answered for another inverter, retry with its serial
+            if self.serial_cache is not None:
+                self.serial_cache.check(lane.ip, lane.port, lane.serial, serial)
+            lane.serial = serial
+            response = self.request(lane, request)
+        return self.decode(response)
+
+    def writeLane(self, lane, params, writer):
+        if lane.serial is None:
+            self.discover(lane)
+        return [writer.checkAck(request, DeyeTCPResponse(self.request(lane, request))) for request in writer.requests(params)]
+
+    def read(self, ip, port, start_reg=0, count_reg=120):
+        return self.submit(ip, port, self.readLane, start_reg, count_reg)
+
+    def write(self, ip, port, params, writer=None):
+        return self.submit(ip, port, self.writeLane, params, writer or RegisterWriter())
+
+    def pollAll(self, addresses, start_reg=0, count_reg=120):
+        # {(ip, port): future} for one read of every logger
+        return {(ip, port): self.read(ip, port, start_reg, count_reg) for ip, port in addresses}
+
+    def pollFleet(self, addresses, start_reg=0, count_reg=120, timeout=None):
+        # Blocks until every read finished, failed polls yield their
+        # exception in place of a response like deye_async.pollFleet
+        futures = self.pollAll(addresses, start_reg, count_reg)
+        wait(futures.values(), timeout)
+        responses = []
+        for (ip, port), future in futures.items():
+            if not future.done():
+                responses.append(TimeoutError(f"{ip}:{port} did not answer in {timeout}s"))
+            else:
+                responses.append(future.exception() or future.result())
+        return responses
+
+    def close(self):
+        # Cancels the jobs still queued in the lanes, waits for the running
+        # ones and closes the connections
+        with self.lock:
+            self.closed = True
+            for lane in self.lanes.values():
+                while lane.jobs:
+                    future, fn, args = lane.jobs.popleft()
+                    future.cancel()
+                lane.running = False
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.pool.close()
+
+
+def main():
+    if len(sys.argv) >= 2 and all(":" in arg for arg in sys.argv[1:]):
+        addresses = []
+        for arg in sys.argv[1:]:
+            ip, port = arg.split(":")
+            addresses.append((ip, int(port)))
+        with FleetPoller(serial_cache=SerialCache()) as poller:
+            for (ip, port), response in zip(addresses, poller.pollFleet(addresses)):
+                if isinstance(response, Exception):
+                    print(f"[-] {ip}:{port}: {response!r}")
+                else:
+                    print(f"[+] {ip}:{port} Serial: {response.invSerial} {response.toDict()}")
+    else:
+        print("Usage: ./fleet.py ip:port [ip:port ...]\nPort is likely 8899")
+
+if __name__ == '__main__':
+    main()
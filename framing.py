@@ -0,0 +1,125 @@
+from checksum import frameChecksum
+
+class FrameReader():
+	# Splits a byte stream into Deye frames: A5, little endian length, body,
+	# checksum, 15. Bytes are collected in one reusable buffer; partial reads
+	# are kept until the frame is complete and stray bytes are skipped.
+	
+	START = 0xa5
+	END = 0x15
+	OVERHEAD = 13
+	# 14 byte data field plus the largest Modbus RTU frame
+	MAX_LENGTH = 14 + 256
+	# Requests carry a 15 byte data field, responses 14 bytes
+	REQUEST_MODBUS_OFFSET = 26
+	RESPONSE_MODBUS_OFFSET = 25
+	
+	def __init__(self, size=2048):
+		self.buffer = bytearray(size)
+		self.start = 0
+		self.end = 0
+
+	def reset(self):
+		self.start = 0
+		self.end = 0
+
+	def pending(self):
+		return self.end - self.start
+
+	def reserve(self, size):
+		if self.start == self.end:
+			self.start = self.end = 0
+		if len(self.buffer) - self.end >= size:
+			return
+		n = self.end - self.start
+		if len(self.buffer) < n + size:
+			self.buffer.extend(bytes(n + size - len(self.buffer)))
+		self.buffer[0:n] = self.buffer[self.start:self.end]
+		self.start = 0
+		self.end = n
+
+	def feed(self, data):
+		self.reserve(len(data))
+		self.buffer[self.end:self.end + len(data)] = data
+		self.end += len(data)
+
+	def recvInto(self, sock, size=1024):
+		self.reserve(size)
+		with memoryview(self.buffer) as view:
+			n = sock.recv_into(view[self.end:self.end + size])
+		self.end += n
+		return n
+
+	def next(self):
+		buf = self.buffer
+		while self.end - self.start >= 3:
+			if buf[self.start] != self.START:
+				pos = buf.find(self.START, self.start, self.end)
+				self.start = self.end if pos < 0 else pos
+				continue
+			length = buf[self.start + 1] | (buf[self.start + 2] << 8)
+			if length > self.MAX_LENGTH:
+				self.start += 1
+				continue
+			total = length + self.OVERHEAD
+			if self.end - self.start < total:
+				# A stray A5 may claim a length that swallows a real frame
+				pos = self.findComplete(self.start + 1)
+				if pos < 0:
+					return None
+				self.start = pos
+				continue
+			if buf[self.start + total - 1] != self.END:
+				self.start += 1
+				continue
+			frame = bytes(buf[self.start:self.start + total])
+			self.start += total
+			return frame
+		return None
+
+	def findComplete(self, pos):
+		buf = self.buffer
+		pos = buf.find(self.START, pos, self.end)
+		while 0 <= pos and self.end - pos >= self.OVERHEAD:
+			total = (buf[pos + 1] | (buf[pos + 2] << 8)) + self.OVERHEAD
+			if total <= self.end - pos and buf[pos + total - 1] == self.END:
+				if frameChecksum(buf, pos, total) == buf[pos + total - 2]:
+					return pos
+			pos = buf.find(self.START, pos + 1, self.end)
+		return -1
+
+	@staticmethod
+	def frameNum(frame):
+		return (frame[5] << 8) | frame[6]
+
+	@staticmethod
+	def sequence(frame):
+		# The logger echoes only the first frame number byte, the second
+		# is its own counter
+		return frame[5]
+
+	@staticmethod
+	def answers(request, response):
+		# Whether the Modbus frame of response fits request: same function
+		# and the byte count of a read or the registers of a write.
+		# Exceptions and logger error replies fit any request.
+		req = request[FrameReader.REQUEST_MODBUS_OFFSET:-2]
+		resp = response[FrameReader.RESPONSE_MODBUS_OFFSET:-2]
+		if len(req) < 6 or len(resp) < 5:
+			return True
+		function = req[1]
+		if resp[1] == function | 0x80:
+			return True
+		if resp[1] != function:
+			return False
+		if function in (0x03, 0x04):
+			return resp[2] == 2 * ((req[4] << 8) | req[5])
+		if function == 0x10:
+			return resp[2:6] == req[2:6]
+		return True
+
+	def frames(self):
+		frame = self.next()
+		while frame is not None:
+			yield frame
+			frame = self.next()
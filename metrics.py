@@ -0,0 +1,146 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = list(self.values.items()) or [((), 0)]
+        for key, value in items:
+            out.append(f"{self.name}{formatLabels(key)} {value}")
+        return out
+
+
+class Histogram:
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, n in zip(self.buckets + ("+Inf",), counts):
+            cumulative += n
+            out.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        out.append(f"{self.name}_sum {total}")
+        out.append(f"{self.name}_count {count}")
+        return out
+
+
+def formatLabels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in key) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class PollerMetrics:
+    # Timings and counters recorded by TransportTCP, ConnectionPool and
+    # DeyeTCPResponse while instrument() has installed them
+    def __init__(self, registry=None, prefix="deye"):
+        self.registry = registry or Registry()
+        r = self.registry.register
+        self.connect = r(Histogram(f"{prefix}_connect_seconds", "TCP connect time to the logger"))
+        self.send = r(Histogram(f"{prefix}_send_seconds", "Time to hand a request frame to the socket"))
+        self.first_byte = r(Histogram(f"{prefix}_first_byte_seconds", "Wait from request sent to first response byte"))
+        self.recv = r(Histogram(f"{prefix}_recv_seconds", "Wait from request sent to complete response frame"))
+        self.decode = r(Histogram(f"{prefix}_decode_seconds", "DeyeTCPResponse validation and parse time", (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)))
+        self.bytes_sent = r(Counter(f"{prefix}_bytes_sent_total", "Request bytes sent"))
+        self.bytes_received = r(Counter(f"{prefix}_bytes_received_total", "Response bytes received"))
+        self.retries = r(Counter(f"{prefix}_retries_total", "Requests sent again after a failure or missing response"))
+        self.errors = r(Counter(f"{prefix}_transport_errors_total", "Transport failures by stage"))
+        self.crc_failures = r(Counter(f"{prefix}_crc_failures_total", "Responses rejected for a bad checksum or CRC"))
+        self.frame_errors = r(Counter(f"{prefix}_frame_errors_total", "Responses rejected for a malformed envelope"))
+        self.parse_errors = r(Counter(f"{prefix}_parse_errors_total", "Fields that failed to parse"))
+
+
+def instrument(metrics=None):
+    # Installs metrics hooks; without them the hot paths only test for None
+    from transport_tcp import TransportTCP
+    from connection_pool import ConnectionPool
+    from deye import DeyeTCPResponse
+    metrics = metrics or PollerMetrics()
+    TransportTCP.metrics = metrics
+    ConnectionPool.metrics = metrics
+    DeyeTCPResponse.metrics = metrics
+    return metrics
+
+
+def uninstrument():
+    from transport_tcp import TransportTCP
+    from connection_pool import ConnectionPool
+    from deye import DeyeTCPResponse
+    TransportTCP.metrics = None
+    ConnectionPool.metrics = None
+    DeyeTCPResponse.metrics = None
+
+
+def serve(registry, port=9108, host="127.0.0.1"):
+    # Serves registry.render() at /metrics from a daemon thread
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,55 @@
+from deye import rModbusResponse, ModbusRequest, DeyeTCPRequest, DeyeTCPResponse
+
+
+class RegisterPlanner:
+    # Maps field names to register ranges through the compiled modbus_parsemap
+    # layout and merges them into as few reads as possible. Ranges closer than
+    # `gap` registers are fetched together, no read exceeds `max_regs`.
+
+    def __init__(self, decoder=rModbusResponse.decoder, max_regs=120, gap=8):
+        self.decoder = decoder
+        self.max_regs = max_regs
+        self.gap = gap
+
+    def registers(self, name):
+        offset, size = self.decoder.index[name]
+        first = offset // 2
+        return first, (offset + size + 1) // 2 - first
+
+    def plan(self, names):
+        spans = sorted(self.registers(name) for name in set(names))
+        reads = []
+        for first, count in spans:
+            if reads:
+                start, length = reads[-1]
+                end = max(start + length, first + count)
+                if first - (start + length) <= self.gap and end - start <= self.max_regs:
+                    reads[-1] = (start, end - start)
+                    continue
+            reads.append((first, count))
+        return reads
+
+    def requests(self, names):
+        return [ModbusRequest(ModbusRequest.DEYE_READ, start, count) for start, count in self.plan(names)]
+
+    def decode(self, names, reads, frames):
+        # frames are the raw responses to plan(names), in the same order
+        out = {}
+        block = DeyeTCPResponse.MODBUS_OFFSET + 3
+        for (start, count), frame in zip(reads, frames):
+            length = frame[DeyeTCPResponse.MODBUS_OFFSET + 2]
+            if length != count * 2:
+                raise ValueError(f"Expected {count * 2} bytes for registers {start}-{start + count - 1}, got {length}")
+            for name in names:
+                first, size = self.registers(name)
+                if start <= first and first + size <= start + count:
+                    out[name] = self.decoder.decodeField(frame, name, block - start * 2)
+        return out
+
+    def poll(self, transport, serial, names):
+        reads = self.plan(names)
+        frames = [DeyeTCPRequest(request, serial).toBytes() for request in self.requests(names)]
+        responses = transport.sendPipelined(frames)
+        for response in responses:
+            DeyeTCPResponse.check(response)
+        return self.decode(names, reads, responses)
@@ -0,0 +1,104 @@
+from deye import ModbusDecoder, ModbusRequest, DeyeTCPResponse, FrameTemplate
+from planner import RegisterPlanner
+from registers import MICROINVERTER, MICROINVERTER_REGISTERS, STRING_3PHASE, STRING_3PHASE_REGISTERS, HYBRID_1PHASE, HYBRID_1PHASE_REGISTERS
+
+import functools
+
+
+class ProfileError(ValueError):
+    pass
+
+
+class Profile:
+    # A register table for the models reporting one of device_types, and
+    # optionally only for the given sComProtoVersion values (hex strings)
+    def __init__(self, name, registers, count, device_types, proto_versions=None, description=""):
+        self.name = name
+        self.registers = list(registers)
+        self.count = count
+        self.device_types = tuple(device_types)
+        self.proto_versions = None if proto_versions is None else tuple(proto_versions)
+        self.description = description
+
+    def __repr__(self):
+        return f"Profile({self.name!r})"
+
+
+class ProfileRegistry:
+    # Picks the register profile of an inverter from sDeviceType and
+    # sComProtoVersion. Decoders are compiled on first use and kept in an
+    # LRU keyed by profile, so a mixed fleet pays the compile once per model.
+    IDENT_REGISTERS = 3
+    READ = bytes.fromhex(ModbusRequest.DEYE_READ)
+
+    def __init__(self, profiles=(), cache_size=16):
+        self.profiles = {}
+        self.models = {}
+        self.decoder = functools.lru_cache(maxsize=cache_size)(self.compile)
+        for profile in profiles:
+            self.register(profile)
+
+    def register(self, profile):
+        # A profile with proto_versions takes precedence over a generic one
+        # for the same device type
+        self.profiles[profile.name] = profile
+        for device_type in profile.device_types:
+            for proto_version in profile.proto_versions or (None,):
+                self.models[(device_type.lower(), proto_version)] = profile
+        self.decoder.cache_clear()
+        return profile
+
+    def get(self, name):
+        try:
+            return self.profiles[name]
+        except KeyError:
+            raise ProfileError(f"Unknown register profile {name}")
+
+    def select(self, device_type, proto_version=None):
+        device_type = device_type.lower()
+        if isinstance(proto_version, bytes):
+            proto_version = proto_version.hex()
+        profile = self.models.get((device_type, proto_version)) or self.models.get((device_type, None))
+        if profile is None:
+            raise ProfileError(f"No register profile for device type {device_type} protocol {proto_version}")
+        return profile
+
+    def compile(self, profile):
+        return ModbusDecoder(profile.registers, profile.count)
+
+    def identify(self, frame):
+        # (sDeviceType, sComProtoVersion hex) of a read response that starts
+        # at register 0
+        block = DeyeTCPResponse.MODBUS_OFFSET + 3
+        if frame[block - 3:block - 1] != self.READ or frame[block - 1] < self.IDENT_REGISTERS * 2:
+            raise ProfileError("Not a read response starting at register 0")
+        return frame[block:block + 2].hex(), frame[block + 4:block + 6].hex()
+
+    def detect(self, frame):
+        return self.select(*self.identify(frame))
+
+    def decodeFrame(self, frame, profile=None):
+        # Decodes a full block read of a single-read profile, detecting the
+        # profile from the frame unless given
+        profile = profile or self.detect(frame)
+        return profile, self.decoder(profile).decodeFrame(frame)
+
+    def probe(self, transport, serial):
+        frame = transport.send(FrameTemplate.get(ModbusRequest.DEYE_READ, 0, self.IDENT_REGISTERS, serial).stamp())
+        DeyeTCPResponse.check(frame)
+        return self.detect(frame)
+
+    def poll(self, transport, serial, names=None, profile=None):
+        # Reads names (all fields by default) with as few requests as the
+        # profile layout allows, returns (profile, values)
+        profile = profile or self.probe(transport, serial)
+        decoder = self.decoder(profile)
+        names = list(decoder.index) if names is None else names
+        return profile, RegisterPlanner(decoder).poll(transport, serial, names)
+
+
+MICROINVERTER_PROFILE = Profile("microinverter", MICROINVERTER, MICROINVERTER_REGISTERS, ["0004"], description="SUN600/800/1000G3 microinverters")
+STRING_3PHASE_PROFILE = Profile("string-3phase", STRING_3PHASE, STRING_3PHASE_REGISTERS, ["0002"], description="SUN-xK-G three phase string inverters")
+HYBRID_1PHASE_PROFILE = Profile("hybrid-1phase", HYBRID_1PHASE, HYBRID_1PHASE_REGISTERS, ["0003"], description="SUN-xK-SG0xLP1 single phase hybrid inverters")
+
+PROFILES = ProfileRegistry([MICROINVERTER_PROFILE, STRING_3PHASE_PROFILE, HYBRID_1PHASE_PROFILE])
@@ -0,0 +1,143 @@
+class Register:
+    # One field of a register block. type is a bitstring style format
+    # ("uint:16", "int:32", "uintle:16", "hex:48", "bytes:10"), scale divides
+    # the raw integer, order is the word order of 32 bit values ("big" high
+    # word first, "little" low word first) and byte the offset of 8 bit
+    # fields inside their register.
+    __slots__ = ("address", "name", "type", "scale", "unit", "order", "val_min", "val_max", "byte", "kind", "bits")
+
+    def __init__(self, address, name, type, scale=None, unit="", order="big", val_min=0, val_max=0, byte=0):
+        self.address = address
+        self.name = name
+        self.type = type
+        self.scale = scale
+        self.unit = unit
+        self.order = order
+        self.val_min = val_min
+        self.val_max = val_max
+        self.byte = byte
+        kind, bits = type.split(":")
+        self.kind = kind
+        self.bits = int(bits)
+
+    @property
+    def size(self):
+        # bytes:N counts bytes, every other format counts bits
+        return self.bits if self.kind == "bytes" else self.bits // 8
+
+    @property
+    def offset(self):
+        return self.address * 2 + self.byte
+
+    def __repr__(self):
+        return f"Register({self.address}, {self.name!r}, {self.type!r})"
+
+
+# Identification registers, at the same address on every Deye model
+HEADER = [
+    Register(0, "sDeviceType", "hex:16"),
+    Register(1, "sModbusAddress", "uintle:16"),
+    Register(2, "sComProtoVersion", "bytes:2"),
+    Register(3, "sSerial", "bytes:10"),
+]
+
+# Microinverter holding registers 0-119 (SUN600/800/1000G3, sDeviceType 0004).
+# The grid protection limits have no documented range and are only written
+# with bounds passed to RegisterWriter.
+MICROINVERTER = HEADER + [
+    Register(16, "sRatedPower", "int:32", 10, "W", "little"),
+    Register(18, "sNumMPPT", "uint:8"),
+    Register(18, "sNumPhases", "uint:8", byte=1),
+    Register(19, "pRatedGridVoltage", "hex:16"),
+    Register(20, "pRemoteLockEnabled", "uint:16", val_min=0, val_max=1),
+    Register(21, "pPostTime", "uint:16", unit="s", val_min=0, val_max=65535),
+    Register(22, "pSystemTime", "hex:48"),
+    Register(27, "pGridVoltageUpperLimit", "int:16", 10, "V"),
+    Register(28, "pGridVoltageLowerLimit", "int:16", 10, "V"),
+    Register(29, "pGridFrequencyUpperLimit", "int:16", 100, "Hz"),
+    Register(30, "pGridFrequencyLowerLimit", "int:16", 100, "Hz"),
+    Register(31, "pGridCurrentUpperLimit", "int:16", 10, "A"),
+    Register(40, "pActivePowerRegulation", "uint:16", unit="%", val_min=0, val_max=100),
+    Register(43, "pSwitchEnable", "uint:16", val_min=0, val_max=1),
+    Register(44, "pFactoryResetEnable", "uint:16", val_min=0, val_max=1),
+    Register(45, "pSelfCheckingTimeIsland", "uint:16", unit="s", val_min=0, val_max=65535),
+    Register(46, "pIslandProtectionEnable", "uint:16", val_min=0, val_max=1),
+    Register(59, "sRunState", "uint:16"),
+    Register(60, "sDayActivePower", "int:16", 10, "kWh"),
+    Register(62, "sUptime", "uint:16", unit="min"),
+    Register(63, "sTotalActivePower", "int:32", 10, "kWh", "little"),
+    Register(65, "sModule1DayActivePower", "int:16", 10, "kWh"),
+    Register(66, "sModule2DayActivePower", "int:16", 10, "kWh"),
+    Register(67, "sModule3DayActivePower", "int:16", 10, "kWh"),
+    Register(68, "sModule4DayActivePower", "int:16", 10, "kWh"),
+    Register(69, "sModule1TotalActivePower", "int:32", 10, "kWh", "little"),
+    Register(71, "sModule2TotalActivePower", "int:32", 10, "kWh", "little"),
+    Register(73, "sGridVoltage", "int:16", 10, "V"),
+    Register(74, "sModule3TotalActivePower", "int:32", 10, "kWh", "little"),
+    Register(76, "sGridCurrent", "int:16", 10, "A"),
+    Register(77, "sModule4TotalActivePower", "int:32", 10, "kWh", "little"),
+    Register(79, "sGridFrequency", "int:16", 100, "Hz"),
+    Register(86, "sActivePower", "int:32", 10, "W", "little"),
+    Register(90, "sTemperature", "int:16", 100, "°C"),
+    Register(109, "sModule1Voltage", "int:16", 10, "V"),
+    Register(110, "sModule1Current", "int:16", 10, "A"),
+    Register(111, "sModule2Voltage", "int:16", 10, "V"),
+    Register(112, "sModule2Current", "int:16", 10, "A"),
+    Register(113, "sModule3Voltage", "int:16", 10, "V"),
+    Register(114, "sModule3Current", "int:16", 10, "A"),
+    Register(115, "sModule4Voltage", "int:16", 10, "V"),
+    Register(116, "sModule4Current", "int:16", 10, "A"),
+]
+MICROINVERTER_REGISTERS = 120
+
+# Three phase string inverter registers 0-119 (SUN-xK-G, sDeviceType 0002)
+STRING_3PHASE = HEADER + [
+    Register(16, "sRatedPower", "int:32", 10, "W", "little"),
+    Register(18, "sNumMPPT", "uint:8"),
+    Register(18, "sNumPhases", "uint:8", byte=1),
+    Register(59, "sRunState", "uint:16"),
+    Register(60, "sDayActivePower", "uint:16", 10, "kWh"),
+    Register(63, "sTotalActivePower", "int:32", 10, "kWh", "little"),
+    Register(73, "sGridVoltageL1", "uint:16", 10, "V"),
+    Register(74, "sGridVoltageL2", "uint:16", 10, "V"),
+    Register(75, "sGridVoltageL3", "uint:16", 10, "V"),
+    Register(76, "sGridCurrentL1", "int:16", 10, "A"),
+    Register(77, "sGridCurrentL2", "int:16", 10, "A"),
+    Register(78, "sGridCurrentL3", "int:16", 10, "A"),
+    Register(79, "sGridFrequency", "uint:16", 100, "Hz"),
+    Register(86, "sActivePower", "int:32", 10, "W", "little"),
+    Register(109, "sModule1Voltage", "uint:16", 10, "V"),
+    Register(110, "sModule1Current", "uint:16", 10, "A"),
+    Register(111, "sModule2Voltage", "uint:16", 10, "V"),
+    Register(112, "sModule2Current", "uint:16", 10, "A"),
+]
+STRING_3PHASE_REGISTERS = 120
+
+# Single phase hybrid inverter registers 0-191 (SUN-xK-SG0xLP1, sDeviceType
+# 0003). Wider than one read, poll it through a RegisterPlanner.
+HYBRID_1PHASE = HEADER + [
+    Register(59, "sRunState", "uint:16"),
+    Register(60, "sDayActivePower", "uint:16", 10, "kWh"),
+    Register(70, "sDayBatteryCharge", "uint:16", 10, "kWh"),
+    Register(71, "sDayBatteryDischarge", "uint:16", 10, "kWh"),
+    Register(76, "sDayGridImport", "uint:16", 10, "kWh"),
+    Register(77, "sDayGridExport", "uint:16", 10, "kWh"),
+    Register(79, "sGridFrequency", "uint:16", 100, "Hz"),
+    Register(84, "sDayLoadEnergy", "uint:16", 10, "kWh"),
+    Register(108, "sDayPVEnergy", "uint:16", 10, "kWh"),
+    Register(109, "sModule1Voltage", "uint:16", 10, "V"),
+    Register(110, "sModule1Current", "uint:16", 10, "A"),
+    Register(111, "sModule2Voltage", "uint:16", 10, "V"),
+    Register(112, "sModule2Current", "uint:16", 10, "A"),
+    Register(150, "sGridVoltage", "uint:16", 10, "V"),
+    Register(169, "sGridPower", "int:16", unit="W"),
+    Register(175, "sInverterPower", "int:16", unit="W"),
+    Register(178, "sLoadPower", "int:16", unit="W"),
+    Register(183, "sBatteryVoltage", "uint:16", 100, "V"),
+    Register(184, "sBatterySOC", "uint:16", unit="%"),
+    Register(186, "sModule1Power", "uint:16", unit="W"),
+    Register(187, "sModule2Power", "uint:16", unit="W"),
+    Register(190, "sBatteryPower", "int:16", unit="W"),
+    Register(191, "sBatteryCurrent", "int:16", 100, "A"),
+]
+HYBRID_1PHASE_REGISTERS = 192
@@ -0,0 +1,202 @@
+import heapq
+import random
+import threading
+import time
+import datetime
+
+
+class SystemClock:
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def hour(self):
+        return datetime.datetime.now().hour
+
+
+class ManualClock:
+    # Deterministic clock for driving the scheduler without waiting
+    def __init__(self, start=0.0, start_hour=12):
+        self.time = start
+        self.start_hour = start_hour
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += max(seconds, 0)
+
+    def hour(self):
+        return int(self.start_hour + self.time // 3600) % 24
+
+
+class FieldGroup:
+    def __init__(self, name, fields, interval):
+        self.name = name
+        self.fields = list(fields)
+        self.interval = interval
+
+
+DEFAULT_GROUPS = [
+    FieldGroup("power", ["sActivePower", "sGridVoltage", "sGridCurrent", "sGridFrequency", "sTemperature", "sRunState",
+                         "sModule1Voltage", "sModule1Current", "sModule2Voltage", "sModule2Current"], 10),
+    FieldGroup("energy", ["sDayActivePower", "sTotalActivePower", "sModule1DayActivePower", "sModule2DayActivePower"], 60),
+    FieldGroup("settings", ["pGridVoltageUpperLimit", "pGridVoltageLowerLimit", "pGridFrequencyUpperLimit",
+                            "pGridFrequencyLowerLimit", "pGridCurrentUpperLimit", "pActivePowerRegulation"], 3600),
+]
+
+
+class PollScheduler:
+    # Polls every logger per field group at the group's interval. Intervals
+    # are stretched while the inverter reports a standby sRunState or during
+    # the night, and every due time gets random jitter so loggers sharing a
+    # Wi-Fi are not hit at once. Groups of one logger due within `coalesce`
+    # seconds of each other are merged into a single poll, and a logger never
+    # has more than one poll in flight; groups falling due meanwhile are held
+    # back until that poll finishes.
+    # poll(logger, fields) returns a {name: value} dict or raises.
+
+    def __init__(self, poll, groups=DEFAULT_GROUPS, clock=None, jitter=0.1, standby_states=(0,), standby_backoff=6, night=(22, 5), night_backoff=6, error_backoff=2, max_backoff=3600, coalesce=2.0, executor=None, seed=None):
+        self.poll = poll
+        self.groups = groups
+        self.clock = clock or SystemClock()
+        self.jitter = jitter
+        self.standby_states = standby_states
+        self.standby_backoff = standby_backoff
+        self.night = night
+        self.night_backoff = night_backoff
+        self.error_backoff = error_backoff
+        self.max_backoff = max_backoff
+        self.coalesce = coalesce
+        self.executor = executor
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.queue = []
+        self.seq = 0
+        self.loggers = set()
+        self.inflight = set()
+        self.deferred = {}
+        self.state = {}
+        self.errors = {}
+
+    def add(self, logger):
+        # First polls are spread over each group's interval
+        with self.lock:
+            self.loggers.add(logger)
+        now = self.clock.now()
+        for group in self.groups:
+            self.push(now + self.random.uniform(0, group.interval), logger, group)
+
+    def remove(self, logger):
+        # A poll still in flight finishes, but its groups are not requeued
+        with self.lock:
+            self.loggers.discard(logger)
+            self.inflight.discard(logger)
+            self.queue = [item for item in self.queue if item[2] != logger]
+            heapq.heapify(self.queue)
+            self.deferred.pop(logger, None)
+            self.state.pop(logger, None)
+            self.errors.pop(logger, None)
+
+    def push(self, due, logger, group):
+        with self.lock:
+            self.seq += 1
+            heapq.heappush(self.queue, (due, self.seq, logger, group))
+
+    def isNight(self):
+        start, end = self.night
+        hour = self.clock.hour()
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def interval(self, logger, group):
+        factor = 1
+        if self.state.get(logger) in self.standby_states:
+            factor *= self.standby_backoff
+        if self.isNight():
+            factor *= self.night_backoff
+        errors = self.errors.get(logger, 0)
+        if errors:
+            factor *= self.error_backoff ** errors
+        interval = min(group.interval * factor, max(group.interval, self.max_backoff))
+        return interval * (1 + self.random.uniform(-self.jitter, self.jitter))
+
+    def nextDue(self):
+        with self.lock:
+            return self.queue[0][0] if self.queue else None
+
+    def takeDue(self):
+        # Pops all due groups and merges them per logger that is not busy
+        now = self.clock.now()
+        due = {}
+        with self.lock:
+            while self.queue and self.queue[0][0] <= now:
+                item = heapq.heappop(self.queue)
+                logger = item[2]
+                if logger in self.inflight:
+                    self.deferred.setdefault(logger, []).append(item)
+                else:
+                    due.setdefault(logger, []).append(item[3])
+            if due and self.coalesce:
+                keep = []
+                for item in self.queue:
+                    if item[2] in due and item[0] <= now + self.coalesce:
+                        due[item[2]].append(item[3])
+                    else:
+                        keep.append(item)
+                if len(keep) != len(self.queue):
+                    self.queue = keep
+                    heapq.heapify(self.queue)
+            self.inflight.update(due)
+        return due
+
+    def finish(self, logger, groups, values=None, error=None):
+        with self.lock:
+            self.inflight.discard(logger)
+            if logger not in self.loggers:
+                return
+            # Groups that fell due during the poll are due again right away
+            for item in self.deferred.pop(logger, ()):
+                heapq.heappush(self.queue, item)
+        if error is None:
+            self.errors.pop(logger, None)
+            if values and "sRunState" in values:
+                self.state[logger] = values["sRunState"]
+        else:
+            self.errors[logger] = min(self.errors.get(logger, 0) + 1, 16)
+        now = self.clock.now()
+        for group in groups:
+            self.push(now + self.interval(logger, group), logger, group)
+
+    def dispatch(self, logger, groups):
+        fields = []
+        for group in groups:
+            fields += [name for name in group.fields if name not in fields]
+        try:
+            values = self.poll(logger, fields)
+        except Exception as e:
+            self.finish(logger, groups, error=e)
+            return e
+        self.finish(logger, groups, values)
+        return values
+
+    def runPending(self):
+        results = {}
+        for logger, groups in self.takeDue().items():
+            if self.executor is not None:
+                results[logger] = self.executor.submit(self.dispatch, logger, groups)
+            else:
+                results[logger] = self.dispatch(logger, groups)
+        return results
+
+    def run(self, until=None, idle=1.0):
+        while until is None or self.clock.now() < until:
+            self.runPending()
+            due = self.nextDue()
+            wait = idle if due is None else min(max(due - self.clock.now(), 0), idle)
+            if until is not None:
+                wait = min(wait, max(until - self.clock.now(), 0))
+            self.clock.sleep(wait if wait > 0 else 0.001)
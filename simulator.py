@@ -0,0 +1,213 @@
+#!/bin/env python3
+
+from deye import rModbusResponse, DeyeTCPResponse
+from framing import FrameReader
+from checksum import modbusCRCBytes, verifyModbusCRC, frameChecksum
+
+import random
+import asyncio
+import argparse
+import struct
+import threading
+
+# Response to a 120 register read, as captured in the README
+SAMPLE_RESPONSE = bytes.fromhex(
+    "a503011015000811fac1ec020100f14500e4050000000000000103f00004010003023233313131353034433600010000120c070001030301"
+    "132200001f4000000201004b0000004130000000000001b0000c0b3b0730141e128e09e2040b0001139c00280000139c006407d000640000"
+    "00000001000100080001000100000001ff010002000a00000000270200000000000000020183000000000bc5000000a1009c0000000005c5"
+    "000005bb0000091a00000000000000000000138800000000000000000000000000da0000000000000b220947094713870000000000000000"
+    "0000000004910000001d00000000000000000000000001480003013600040000000000000000014801400000fa886315"
+)
+
+
+class SimulatedInverter:
+    # One logger/inverter pair answering the Deye TCP protocol: reads and
+    # writes of the register block, an error frame for a wrong serial, plus
+    # configurable latency, jitter, split responses and dropped requests.
+    CONTROLCODE = bytes.fromhex("1015")
+    DATAFIELD = SAMPLE_RESPONSE[11:25]
+    REQUEST_MODBUS_OFFSET = 26
+
+    def __init__(self, serial, block=None, latency=0.05, jitter=0.02, split_rate=0.0, drop_rate=0.0, disconnect_rate=0.0, vary=True, rng=None):
+        offset = DeyeTCPResponse.MODBUS_OFFSET + 3
+        self.serial = serial
+        self.block = bytearray(block or SAMPLE_RESPONSE[offset:offset + rModbusResponse.decoder.size])
+        self.latency = latency
+        self.jitter = jitter
+        self.split_rate = split_rate
+        self.drop_rate = drop_rate
+        self.disconnect_rate = disconnect_rate
+        self.vary = vary
+        self.random = rng or random.Random(serial)
+        self.requests = 0
+        self.server = None
+
+    def frame(self, request, modbus):
+        # Like the logger, echoes only the first frame number byte and puts
+        # its own counter in the second
+        length = len(self.DATAFIELD) + len(modbus)
+        frame = bytearray(b"\xa5" + length.to_bytes(2, "little") + self.CONTROLCODE + bytes([request[5], self.requests & 255]) + self.serial.to_bytes(4, "little") + self.DATAFIELD + modbus + b"\x00\x15")
+        frame[-2] = frameChecksum(frame)
+        return bytes(frame)
+
+    def modbus(self, pdu):
+        return pdu + modbusCRCBytes(pdu)
+
+    def exception(self, function, code):
+        return self.modbus(bytes([0x01, function | 0x80, code]))
+
+    def step(self):
+        # Small random walk of the live values so consecutive reads differ
+        index = rModbusResponse.decoder.index
+        offset = index["sActivePower"][0]
+        low, high = struct.unpack_from(">hh", self.block, offset)
+        power = max(0, min(8000, ((high << 16) + low) + self.random.randint(-20, 20)))
+        struct.pack_into(">hh", self.block, offset, power, 0)
+        offset = index["sGridVoltage"][0]
+        voltage = struct.unpack_from(">h", self.block, offset)[0] + self.random.randint(-2, 2)
+        struct.pack_into(">h", self.block, offset, max(2100, min(2500, voltage)))
+
+    def handle(self, request):
+        if int.from_bytes(request[7:11], "little") != self.serial:
+            # Loggers answer an unknown serial with a short frame carrying their own
+            return self.frame(request, bytes.fromhex("0600"))
+        modbus = request[self.REQUEST_MODBUS_OFFSET:-2]
+        if not verifyModbusCRC(modbus):
+            return None
+        function = modbus[1]
+        start, count = struct.unpack_from(">HH", modbus, 2)
+        if function == 0x03:
+            if count == 0 or (start + count) * 2 > len(self.block):
+                return self.frame(request, self.exception(function, 0x02))
+            if self.vary:
+                self.step()
+            data = bytes(self.block[start * 2:(start + count) * 2])
+            return self.frame(request, self.modbus(bytes([0x01, 0x03, len(data)]) + data))
+        if function == 0x10:
+            data = modbus[7:7 + modbus[6]]
+            if len(data) != count * 2 or (start + count) * 2 > len(self.block):
+                return self.frame(request, self.exception(function, 0x02))
+            self.block[start * 2:(start + count) * 2] = data
+            return self.frame(request, self.modbus(bytes(modbus[0:6])))
+        return self.frame(request, self.exception(function, 0x01))
+
+    async def reply(self, writer, response):
+        if self.split_rate and self.random.random() < self.split_rate:
+            cut = sorted(self.random.sample(range(1, len(response)), min(3, len(response) - 1)))
+            parts = [response[a:b] for a, b in zip([0] + cut, cut + [len(response)])]
+            for part in parts:
+                writer.write(part)
+                await writer.drain()
+                await asyncio.sleep(0.001)
+        else:
+            writer.write(response)
+            await writer.drain()
+
+    async def session(self, reader, writer):
+        framer = FrameReader()
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                framer.feed(data)
+                for request in framer.frames():
+                    self.requests += 1
+                    if self.disconnect_rate and self.random.random() < self.disconnect_rate:
+                        return
+                    if self.drop_rate and self.random.random() < self.drop_rate:
+                        continue
+                    response = self.handle(request)
+                    if response is None:
+                        continue
+                    await asyncio.sleep(max(0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+                    await self.reply(writer, response)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self.session, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+class Simulator:
+    # A fleet of simulated inverters, each on its own port, in one event loop.
+    # Thousands of inverters need a matching open file limit (ulimit -n).
+
+    def __init__(self, count, host="127.0.0.1", base_port=0, first_serial=3000000000, seed=0, **options):
+        rng = random.Random(seed)
+        self.host = host
+        self.base_port = base_port
+        self.inverters = [SimulatedInverter(first_serial + i, rng=random.Random(rng.random()), **options) for i in range(count)]
+        self.addresses = []
+
+    async def start(self):
+        for i, inverter in enumerate(self.inverters):
+            port = self.base_port + i if self.base_port else 0
+            self.addresses.append(await inverter.start(self.host, port))
+        return self.addresses
+
+    async def stop(self):
+        await asyncio.gather(*(inverter.stop() for inverter in self.inverters))
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def startThread(self):
+        # Runs the fleet on its own event loop thread, for synchronous clients
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        return asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+
+    def stopThread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        self.startThread()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopThread()
+
+
+async def serve(args):
+    options = dict(latency=args.latency, jitter=args.jitter, split_rate=args.split_rate, drop_rate=args.drop_rate, disconnect_rate=args.disconnect_rate)
+    async with Simulator(args.count, args.host, args.base_port, **options) as simulator:
+        first, last = simulator.addresses[0], simulator.addresses[-1]
+        print(f"[+] Simulating {args.count} inverters on {first[0]}:{first[1]} .. {last[0]}:{last[1]}")
+        await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="simulator.py")
+    parser.add_argument("count", type=int, nargs="?", default=1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=8899)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--split-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
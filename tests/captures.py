@@ -0,0 +1,17 @@
+# Frames captured from a SUN600G3 logger, as listed at the end of deye.py
+
+REQUEST = bytes.fromhex("a5 1700 1045 0000 11fac1ec 02 0000000000000000000000000000 0103 003c 0001 4406 b1 15".replace(" ", ""))
+
+RESPONSES = [bytes.fromhex(line.replace(" ", "")) for line in """
+a5 1500 1015 0030 11fac1ec 02 0116d703004e06000000000000 0103 0200 6d79 a9fe 15
+a5 1500 1015 0031 11fac1ec 02 0117d703004f06000000000000 0103 0200 6d79 a901 15
+a5 1500 1015 0032 11fac1ec 02 0119d703005006000000000000 0103 0200 6d79 a905 15
+a5 1500 1015 0033 11fac1ec 02 011ad703005206000000000000 0103 0200 6d79 a909 15
+a5 1700 1015 0001 11fac1ec 02 013bd903007101000000000000 0103 0400 6e00 009b ee80 15
+a5 1900 1015 0002 11fac1ec 02 0135db03006b03000000000000 0103 0600 6e00 0000 00c8 bc78 15
+""".split("\n") if line]
+
+# Logger error reply without a Modbus frame
+ERROR_REPLY = bytes.fromhex("a5 1000 1015 001b 11fac1ec 02 019dfe0300c803000000000000 0600 7a 15".replace(" ", ""))
+
+FRAMES = [REQUEST] + RESPONSES + [ERROR_REPLY]
@@ -0,0 +1,97 @@
+import unittest
+
+from captures import REQUEST, RESPONSES, ERROR_REPLY
+from checksum import modbusCRC, modbusCRCBytes, verifyModbusCRC, frameChecksum, verifyFrameChecksum
+from deye import DeyeTCPResponse, FrameError, ChecksumError
+
+# The request carries one more data field byte than the responses
+REQUEST_MODBUS_OFFSET = 26
+
+
+def flipped(frame, pos):
+    frame = bytearray(frame)
+    frame[pos] ^= 0x01
+    return bytes(frame)
+
+
+class ModbusCRCTest(unittest.TestCase):
+
+    def test_request_crc(self):
+        modbus = REQUEST[REQUEST_MODBUS_OFFSET:-2]
+        self.assertEqual(modbusCRCBytes(modbus[:-2]), modbus[-2:])
+        self.assertTrue(verifyModbusCRC(modbus))
+
+    def test_response_crc(self):
+        for frame in RESPONSES:
+            modbus = frame[DeyeTCPResponse.MODBUS_OFFSET:-2]
+            self.assertEqual(modbusCRCBytes(modbus[:-2]), modbus[-2:])
+            self.assertEqual(modbusCRC(modbus), 0)
+            self.assertTrue(verifyModbusCRC(modbus))
+
+    def test_flipped_byte(self):
+        modbus = RESPONSES[0][DeyeTCPResponse.MODBUS_OFFSET:-2]
+        for pos in range(len(modbus)):
+            self.assertFalse(verifyModbusCRC(flipped(modbus, pos)))
+
+    def test_too_short(self):
+        self.assertFalse(verifyModbusCRC(b"\x01\x03\x00\x00"))
+
+
+class FrameChecksumTest(unittest.TestCase):
+
+    def test_captured_frames(self):
+        for frame in [REQUEST, ERROR_REPLY] + RESPONSES:
+            self.assertEqual(frameChecksum(frame), frame[-2])
+            self.assertTrue(verifyFrameChecksum(frame))
+
+    def test_frame_inside_buffer(self):
+        buffer = b"\x00\x00" + RESPONSES[0] + RESPONSES[1]
+        self.assertEqual(frameChecksum(buffer, 2, len(RESPONSES[0])), RESPONSES[0][-2])
+
+    def test_flipped_byte(self):
+        frame = RESPONSES[0]
+        for pos in range(1, len(frame) - 2):
+            self.assertFalse(verifyFrameChecksum(flipped(frame, pos)))
+
+
+class ValidateTest(unittest.TestCase):
+
+    def test_captured_responses(self):
+        for frame in RESPONSES + [ERROR_REPLY]:
+            DeyeTCPResponse.validate(frame)
+
+    def test_flipped_byte(self):
+        # Every single bit error is caught, by the framing, the frame
+        # checksum or the Modbus CRC
+        for frame in RESPONSES:
+            for pos in range(len(frame)):
+                with self.assertRaises(FrameError):
+                    DeyeTCPResponse.validate(flipped(frame, pos))
+
+    def test_flipped_modbus_byte_with_fixed_checksum(self):
+        frame = bytearray(flipped(RESPONSES[0], DeyeTCPResponse.MODBUS_OFFSET + 3))
+        frame[-2] = frameChecksum(frame)
+        with self.assertRaisesRegex(ChecksumError, "Modbus CRC"):
+            DeyeTCPResponse.validate(bytes(frame))
+
+    def test_bad_frame_checksum(self):
+        frame = bytearray(RESPONSES[0])
+        frame[-2] ^= 0xff
+        with self.assertRaisesRegex(ChecksumError, "frame checksum"):
+            DeyeTCPResponse.validate(bytes(frame))
+
+    def test_truncated(self):
+        with self.assertRaisesRegex(FrameError, "too short"):
+            DeyeTCPResponse.validate(RESPONSES[0][:12])
+        with self.assertRaisesRegex(FrameError, "Length field"):
+            DeyeTCPResponse.validate(RESPONSES[0][:-3] + RESPONSES[0][-2:])
+
+    def test_bad_start_and_end(self):
+        with self.assertRaisesRegex(FrameError, "start byte"):
+            DeyeTCPResponse.validate(b"\xa4" + RESPONSES[0][1:])
+        with self.assertRaisesRegex(FrameError, "end byte"):
+            DeyeTCPResponse.validate(RESPONSES[0][:-1] + b"\x16")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import threading
+import time
+import unittest
+
+from checksum import verifyFrameChecksum
+from connection_pool import ConnectionPool
+from deye import DeyeTCPRequest, DeyeTCPResponse, ModbusRequest
+from framing import FrameReader
+from simulator import Simulator
+
+SERIAL = 3000000000
+
+
+def readRequest(count=2):
+    return DeyeTCPRequest(ModbusRequest(ModbusRequest.DEYE_READ, 0, count), SERIAL).toBytes()
+
+
+class FlakyTransport:
+    # Stand-in for TransportTCP whose first `failures` connects are refused
+    failures = 0
+    started = 0
+
+    def __init__(self, ip, port):
+        self.ip = ip
+        self.port = port
+        self.s = None
+        self.framer = FrameReader()
+
+    def start(self):
+        FlakyTransport.started += 1
+        if FlakyTransport.started <= FlakyTransport.failures:
+            raise ConnectionRefusedError("refused")
+        self.s = object()
+
+    def stop(self):
+        self.s = None
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.simulator = Simulator(1, latency=0, jitter=0, vary=False)
+        cls.simulator.startThread()
+        cls.address = cls.simulator.addresses[0]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.simulator.stopThread()
+
+    def setUp(self):
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_send(self):
+        response = self.pool.send(*self.address, readRequest())
+        self.assertTrue(verifyFrameChecksum(response))
+        self.assertEqual(int.from_bytes(response[7:11], "little"), SERIAL)
+
+    def test_connection_is_reused(self):
+        with self.pool.connection(*self.address) as first:
+            first.send(readRequest())
+        with self.pool.connection(*self.address) as second:
+            self.assertIs(second, first)
+
+    def test_unread_answer_is_not_reused(self):
+        with self.pool.connection(*self.address) as first:
+            # The answer arrives after the caller gave up on it
+            first.s.sendall(readRequest())
+            time.sleep(0.1)
+        with self.pool.connection(*self.address) as second:
+            self.assertIsNot(second, first)
+            response = second.send(readRequest(4))
+        self.assertEqual(response[DeyeTCPResponse.MODBUS_OFFSET + 2], 8)
+        self.assertIsNone(first.s)
+
+    def test_framer_leftovers_are_not_reused(self):
+        with self.pool.connection(*self.address) as first:
+            first.framer.feed(b"\xa5\x10")
+        with self.pool.connection(*self.address) as second:
+            self.assertIsNot(second, first)
+
+    def test_closed_connection_is_replaced(self):
+        with self.pool.connection(*self.address) as first:
+            pass
+        first.s.close()
+        with self.pool.connection(*self.address) as second:
+            self.assertIsNot(second, first)
+            self.assertTrue(second.send(readRequest()))
+
+    def test_idle_connections_are_evicted(self):
+        now = [0.0]
+        pool = ConnectionPool(idle_timeout=60, clock=lambda: now[0])
+        try:
+            with pool.connection(*self.address) as first:
+                pass
+            now[0] = 61
+            with pool.connection(*self.address) as second:
+                self.assertIsNot(second, first)
+            self.assertIsNone(first.s)
+        finally:
+            pool.close()
+
+    def test_per_logger_cap_and_timeout(self):
+        transport = self.pool.acquire(*self.address)
+        with self.assertRaises(TimeoutError):
+            self.pool.acquire(*self.address, timeout=0.05)
+        threading.Timer(0.05, self.pool.release, [transport]).start()
+        self.assertIs(self.pool.acquire(*self.address, timeout=2), transport)
+        self.pool.release(transport)
+
+    def test_broken_connection_frees_its_slot(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.connection(*self.address):
+                raise RuntimeError("failed")
+        self.pool.release(self.pool.acquire(*self.address, timeout=0.05))
+
+    def test_dropped_connections_are_retried(self):
+        with Simulator(1, latency=0, jitter=0, disconnect_rate=0.3, seed=3) as simulator:
+            pool = ConnectionPool()
+            try:
+                for _ in range(30):
+                    response = pool.send(*simulator.addresses[0], readRequest(), attempts=8)
+                    self.assertTrue(verifyFrameChecksum(response))
+            finally:
+                pool.close()
+            self.assertGreater(simulator.inverters[0].requests, 30)
+
+
+class BackoffTest(unittest.TestCase):
+
+    def setUp(self):
+        FlakyTransport.started = 0
+        self.sleeps = []
+
+    def pool(self, failures, **options):
+        FlakyTransport.failures = failures
+        return ConnectionPool(transport=FlakyTransport, sleep=self.sleeps.append, **options)
+
+    def test_connect_is_retried_with_backoff(self):
+        transport = self.pool(3, backoff=0.5).acquire("10.0.0.1", 8899)
+        self.assertIsNotNone(transport.s)
+        self.assertEqual(self.sleeps, [0.5, 1.0, 2.0])
+
+    def test_backoff_is_capped(self):
+        self.pool(6, retries=6, backoff=1, backoff_max=4).acquire("10.0.0.1", 8899)
+        self.assertEqual(self.sleeps, [1, 2, 4, 4, 4, 4])
+
+    def test_gives_up_after_retries(self):
+        pool = self.pool(10, retries=2)
+        with self.assertRaises(ConnectionRefusedError):
+            pool.acquire("10.0.0.1", 8899)
+        self.assertEqual(len(self.sleeps), 2)
+        # The failed connect does not hold the logger's slot
+        FlakyTransport.failures = 0
+        self.assertIsNotNone(pool.acquire("10.0.0.1", 8899, timeout=0).s)
+
+
+if __name__ == "__main__":
+    unittest.main()
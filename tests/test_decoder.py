@@ -0,0 +1,29 @@
+import unittest
+
+from benchmark import SAMPLE_RESPONSE
+from deye import DeyeTCPResponse, rModbusResponse
+
+BLOCK = DeyeTCPResponse.MODBUS_OFFSET + 3
+
+
+class EncodeTest(unittest.TestCase):
+    decoder = rModbusResponse.decoder
+
+    def roundtrip(self, name, value):
+        offset = self.decoder.index[name][0]
+        return self.decoder.decodeField(self.decoder.encode(name, value), name, -offset)
+
+    def test_sample_fields_roundtrip(self):
+        values = self.decoder.decodeFrame(SAMPLE_RESPONSE)
+        for name, value in values.items():
+            offset, size = self.decoder.index[name]
+            if size % 2 == 0 and offset % 2 == 0:
+                self.assertEqual(self.decoder.encode(name, value), SAMPLE_RESPONSE[BLOCK + offset:BLOCK + offset + size], name)
+
+    def test_low_word_first_values_roundtrip(self):
+        for value in (0, 0.1, 100.0, 3276.7, 3276.8, 5123.4, -5.0, -3276.9, 123456.7):
+            self.assertEqual(self.roundtrip("sTotalActivePower", value), value)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+
+from deye import ChecksumError, FrameError
+from deye_async import AsyncDeyeClient, pollFleet
+from simulator import SimulatedInverter, Simulator
+
+
+class CorruptInverter(SimulatedInverter):
+    # Answers every request with a bad frame checksum
+    def frame(self, request, modbus):
+        frame = bytearray(super().frame(request, modbus))
+        frame[-2] ^= 0xff
+        return bytes(frame)
+
+
+def fleet(count, replace=None, **options):
+    simulator = Simulator(count, latency=0, jitter=0, vary=False, **options)
+    for i, inverter in (replace or {}).items():
+        simulator.inverters[i] = inverter
+    return simulator
+
+
+class PollFleetTest(unittest.TestCase):
+
+    def poll(self, simulator):
+        async def run():
+            async with simulator:
+                return await pollFleet(simulator.addresses, timeout=2)
+
+        return asyncio.run(run())
+
+    def test_all_answer(self):
+        simulator = fleet(3)
+        responses = self.poll(simulator)
+        self.assertEqual([response.values["InvSerial"].value for response in responses], [inverter.serial for inverter in simulator.inverters])
+
+    def test_bad_frame_yields_its_exception(self):
+        simulator = fleet(3, {1: CorruptInverter(3000000001, latency=0, jitter=0)})
+        responses = self.poll(simulator)
+        self.assertIsInstance(responses[1], ChecksumError)
+        self.assertEqual(responses[0].values["InvSerial"].value, 3000000000)
+        self.assertEqual(responses[2].values["InvSerial"].value, 3000000002)
+
+    def test_disconnect_yields_its_exception(self):
+        simulator = fleet(3, {2: SimulatedInverter(3000000002, latency=0, jitter=0, disconnect_rate=1.0)})
+        responses = self.poll(simulator)
+        self.assertIsInstance(responses[2], FrameError)
+        self.assertEqual(responses[0].values["InvSerial"].value, 3000000000)
+
+    def test_refused_connection_yields_its_exception(self):
+        simulator = fleet(1)
+
+        async def run():
+            async with simulator:
+                address = simulator.addresses[0]
+            return await pollFleet([address], timeout=1)
+
+        self.assertIsInstance(asyncio.run(run())[0], OSError)
+
+
+class AsyncDeyeClientTest(unittest.TestCase):
+
+    def test_discovers_serial_and_reads(self):
+        simulator = fleet(1)
+
+        async def run():
+            async with simulator:
+                async with AsyncDeyeClient(*simulator.addresses[0], timeout=2) as client:
+                    response = await client.read()
+                    return client.serial, response.values["ModbusResponse"].values["ModbusLength"].value
+
+        self.assertEqual(asyncio.run(run()), (3000000000, 240))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+import random
+import socket
+import threading
+import time
+import unittest
+
+from captures import FRAMES, RESPONSES
+from checksum import verifyFrameChecksum
+from deye import DeyeTCPRequest, ModbusRequest
+from framing import FrameReader
+from simulator import SimulatedInverter
+from transport_tcp import TransportTCP
+
+
+def readAll(reader, chunks):
+    frames = []
+    for chunk in chunks:
+        reader.feed(chunk)
+        frames.extend(reader.frames())
+    return frames
+
+
+class FrameReaderTest(unittest.TestCase):
+
+    def test_single_frame(self):
+        self.assertEqual(readAll(FrameReader(), [FRAMES[1]]), [FRAMES[1]])
+
+    def test_byte_by_byte(self):
+        reader = FrameReader()
+        frame = FRAMES[1]
+        for i in range(len(frame) - 1):
+            reader.feed(frame[i:i + 1])
+            self.assertIsNone(reader.next())
+        reader.feed(frame[-1:])
+        self.assertEqual(reader.next(), frame)
+        self.assertEqual(reader.pending(), 0)
+
+    def test_multi_frame_stream_byte_by_byte(self):
+        stream = b"".join(FRAMES)
+        self.assertEqual(readAll(FrameReader(), [stream[i:i + 1] for i in range(len(stream))]), FRAMES)
+
+    def test_back_to_back_frames(self):
+        self.assertEqual(readAll(FrameReader(), [b"".join(FRAMES)]), FRAMES)
+
+    def test_random_splits(self):
+        rng = random.Random(1)
+        stream = b"".join(FRAMES * 20)
+        for _ in range(200):
+            cuts = sorted(rng.sample(range(1, len(stream)), rng.randint(1, 60)))
+            chunks = [stream[a:b] for a, b in zip([0] + cuts, cuts + [len(stream)])]
+            self.assertEqual(readAll(FrameReader(size=16), chunks), FRAMES * 20)
+
+    def test_stray_bytes_are_skipped(self):
+        stream = b"\x00\x15garbage" + FRAMES[1] + b"\xff\xa5" + FRAMES[2] + b"\x15\x15" + FRAMES[3]
+        self.assertEqual(readAll(FrameReader(), [stream]), FRAMES[1:4])
+
+    def test_stray_start_byte_claiming_a_long_frame(self):
+        # A5 followed by a length that would swallow the real frame after it
+        stream = b"\xa5\xff\x00" + FRAMES[1] + FRAMES[2]
+        self.assertEqual(readAll(FrameReader(), [stream]), FRAMES[1:3])
+
+    def test_wrong_end_byte_is_dropped(self):
+        broken = FRAMES[1][:-1] + b"\x00"
+        self.assertEqual(readAll(FrameReader(), [broken + FRAMES[2]]), [FRAMES[2]])
+
+    def test_partial_frame_is_kept(self):
+        reader = FrameReader()
+        reader.feed(FRAMES[1] + FRAMES[2][:10])
+        self.assertEqual(reader.next(), FRAMES[1])
+        self.assertIsNone(reader.next())
+        self.assertEqual(reader.pending(), 10)
+        reader.feed(FRAMES[2][10:])
+        self.assertEqual(reader.next(), FRAMES[2])
+
+    def test_frame_number(self):
+        self.assertEqual([FrameReader.frameNum(frame) for frame in RESPONSES], [0x30, 0x31, 0x32, 0x33, 0x01, 0x02])
+
+
+class TransportTCPFramingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = TransportTCP("127.0.0.1", 0)
+        self.transport.s, self.peer = socket.socketpair()
+        self.transport.s.settimeout(2)
+
+    def tearDown(self):
+        self.transport.stop()
+        self.peer.close()
+
+    def test_recv_frame_from_trickled_stream(self):
+        stream = b"".join(FRAMES)
+        for i in range(len(stream)):
+            self.peer.sendall(stream[i:i + 1])
+        self.assertEqual([self.transport.recvFrame() for _ in FRAMES], FRAMES)
+
+    def test_recv_frame_keeps_following_frames(self):
+        self.peer.sendall(b"\x00" + FRAMES[1] + FRAMES[2] + FRAMES[3][:5])
+        self.assertEqual(self.transport.recvFrame(), FRAMES[1])
+        self.assertEqual(self.transport.recvFrame(), FRAMES[2])
+        self.peer.sendall(FRAMES[3][5:])
+        self.assertEqual(self.transport.recvFrame(), FRAMES[3])
+
+    def test_closed_connection(self):
+        self.peer.sendall(FRAMES[1][:5])
+        self.peer.close()
+        self.assertEqual(self.transport.recvFrame(), b"")
+
+
+class SendPipelinedTest(unittest.TestCase):
+    SERIAL = 3000000000
+    READS = [(0, 10), (10, 4), (20, 10), (30, 6)]
+
+    def setUp(self):
+        self.transport = TransportTCP("127.0.0.1", 0)
+        self.transport.s, self.peer = socket.socketpair()
+        self.transport.s.settimeout(2)
+        self.peer.settimeout(2)
+        self.inverter = SimulatedInverter(self.SERIAL, latency=0, jitter=0, vary=False)
+
+    def tearDown(self):
+        self.transport.stop()
+        self.peer.close()
+
+    def requests(self):
+        return [DeyeTCPRequest(ModbusRequest(ModbusRequest.DEYE_READ, start, count), self.SERIAL).toBytes() for start, count in self.READS]
+
+    def serve(self, reply):
+        # Reads every request, then lets reply(requests) pick the answers
+        def run():
+            reader = FrameReader()
+            requests = []
+            while len(requests) < len(self.READS):
+                reader.feed(self.peer.recv(1024))
+                requests.extend(reader.frames())
+            for response in reply(requests):
+                self.peer.sendall(response)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def data(self, response):
+        return response[28:-4]
+
+    def expected(self):
+        return [bytes(self.inverter.block[start * 2:(start + count) * 2]) for start, count in self.READS]
+
+    def test_requests_get_distinct_echoed_bytes(self):
+        frames = [self.transport.stampSequence(frame) for frame in self.requests()]
+        self.assertEqual(len({FrameReader.sequence(frame) for frame in frames}), len(frames))
+        for frame in frames:
+            self.assertTrue(verifyFrameChecksum(frame))
+
+    def test_out_of_order_responses(self):
+        def reply(requests):
+            responses = [bytearray(self.inverter.handle(request)) for request in requests]
+            # The logger's own counter collides with another request
+            for response, request in zip(responses, requests):
+                response[6] = requests[0][6]
+            return [bytes(response) for response in reversed(responses)]
+
+        thread = self.serve(reply)
+        responses = self.transport.sendPipelined(self.requests())
+        thread.join()
+        self.assertEqual([self.data(response) for response in responses], self.expected())
+
+    def test_stale_and_mismatched_responses_are_dropped(self):
+        def reply(requests):
+            stale = bytearray(self.inverter.handle(requests[0]))
+            stale[5] = (requests[0][5] - 1) & 255
+            # Right echoed byte, wrong byte count
+            swapped = bytearray(self.inverter.handle(requests[1]))
+            swapped[5] = requests[0][5]
+            return [bytes(stale), bytes(swapped)] + [self.inverter.handle(request) for request in requests]
+
+        thread = self.serve(reply)
+        responses = self.transport.sendPipelined(self.requests())
+        thread.join()
+        self.assertEqual([self.data(response) for response in responses], self.expected())
+
+    def test_late_answer_is_not_left_for_the_next_send(self):
+        self.transport.s.settimeout(0.2)
+        late = []
+
+        def reply(requests):
+            late.append(self.inverter.handle(requests[1]))
+            return [self.inverter.handle(requests[0]), self.inverter.handle(requests[2]), self.inverter.handle(requests[3])]
+
+        def resend():
+            time.sleep(0.4)
+            self.peer.sendall(late[0])
+            reader = FrameReader()
+            for _ in range(2):
+                frame = None
+                while frame is None:
+                    reader.feed(self.peer.recv(1024))
+                    frame = reader.next()
+                self.peer.sendall(self.inverter.handle(frame))
+
+        thread = self.serve(reply)
+        follow = threading.Thread(target=resend)
+        follow.start()
+        responses = self.transport.sendPipelined(self.requests())
+        thread.join()
+        self.assertEqual([self.data(response) for response in responses], self.expected())
+        self.transport.s.settimeout(2)
+        request = DeyeTCPRequest(ModbusRequest(ModbusRequest.DEYE_READ, 40, 2), self.SERIAL).toBytes()
+        response = self.transport.send(request)
+        follow.join()
+        self.assertEqual(self.data(response), bytes(self.inverter.block[80:84]))
+
+
+if __name__ == "__main__":
+    unittest.main()
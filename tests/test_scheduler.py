@@ -0,0 +1,154 @@
+import unittest
+
+from scheduler import FieldGroup, ManualClock, PollScheduler
+
+FAST = FieldGroup("fast", ["sActivePower", "sRunState"], 10)
+SLOW = FieldGroup("slow", ["sTotalActivePower"], 60)
+HOURLY = FieldGroup("hourly", ["pActivePowerRegulation"], 3600)
+
+
+class Poller:
+    # Records every poll and answers with a fixed sRunState or raises
+    def __init__(self, state=2, error=None):
+        self.state = state
+        self.error = error
+        self.calls = []
+
+    def __call__(self, logger, fields):
+        self.calls.append((logger, sorted(fields)))
+        if self.error is not None:
+            raise self.error
+        return {"sRunState": self.state}
+
+
+class PollSchedulerTest(unittest.TestCase):
+
+    def scheduler(self, poll=None, start_hour=12, **options):
+        self.clock = ManualClock(start_hour=start_hour)
+        self.poll = poll or Poller()
+        options.setdefault("jitter", 0)
+        return PollScheduler(self.poll, groups=[FAST, SLOW, HOURLY], clock=self.clock, seed=1, **options)
+
+    def schedule(self, scheduler, logger, entries):
+        # Registers logger with explicit due times instead of add()'s spread
+        with scheduler.lock:
+            scheduler.loggers.add(logger)
+        for due, group in entries:
+            scheduler.push(due, logger, group)
+
+    def entries(self, scheduler, logger):
+        return sorted((due, group.name) for due, _, name, group in scheduler.queue if name == logger)
+
+    def test_first_polls_are_spread(self):
+        scheduler = self.scheduler()
+        scheduler.add("a")
+        dues = dict((name, due) for due, name in self.entries(scheduler, "a"))
+        self.assertTrue(0 <= dues["fast"] <= 10)
+        self.assertTrue(0 <= dues["slow"] <= 60)
+
+    def test_coalescing(self):
+        scheduler = self.scheduler(coalesce=2)
+        self.schedule(scheduler, "a", [(10, FAST), (11, SLOW), (13, HOURLY)])
+        self.clock.time = 10
+        scheduler.runPending()
+        self.assertEqual(self.poll.calls, [("a", sorted(FAST.fields + SLOW.fields))])
+        self.assertEqual(self.entries(scheduler, "a"), [(13, "hourly"), (20, "fast"), (70, "slow")])
+
+    def test_no_coalescing(self):
+        scheduler = self.scheduler(coalesce=0)
+        self.schedule(scheduler, "a", [(10, FAST), (11, SLOW)])
+        self.clock.time = 10
+        scheduler.runPending()
+        self.assertEqual(self.poll.calls, [("a", sorted(FAST.fields))])
+
+    def test_loggers_are_polled_separately(self):
+        scheduler = self.scheduler()
+        self.schedule(scheduler, "a", [(5, FAST)])
+        self.schedule(scheduler, "b", [(5, FAST)])
+        self.clock.time = 5
+        self.assertEqual(sorted(scheduler.runPending()), ["a", "b"])
+        self.assertEqual(len(self.poll.calls), 2)
+
+    def test_standby_backoff(self):
+        scheduler = self.scheduler(Poller(state=0), standby_backoff=6)
+        self.schedule(scheduler, "a", [(0, FAST)])
+        scheduler.runPending()
+        self.assertEqual(self.entries(scheduler, "a"), [(60, "fast")])
+
+    def test_night_backoff(self):
+        scheduler = self.scheduler(start_hour=23, night_backoff=6)
+        self.schedule(scheduler, "a", [(0, FAST)])
+        scheduler.runPending()
+        self.assertEqual(self.entries(scheduler, "a"), [(60, "fast")])
+
+    def test_night_wraps_midnight(self):
+        scheduler = self.scheduler(start_hour=3)
+        self.assertTrue(scheduler.isNight())
+        scheduler = self.scheduler(start_hour=5)
+        self.assertFalse(scheduler.isNight())
+
+    def test_error_backoff(self):
+        scheduler = self.scheduler(Poller(error=OSError("refused")), error_backoff=2, max_backoff=35)
+        self.schedule(scheduler, "a", [(0, FAST)])
+        dues = []
+        for _ in range(4):
+            self.clock.time = scheduler.nextDue()
+            self.assertIsInstance(scheduler.runPending()["a"], OSError)
+            dues.append(scheduler.nextDue() - self.clock.time)
+        self.assertEqual(dues, [20, 35, 35, 35])
+
+    def test_error_backoff_resets(self):
+        poll = Poller(error=OSError("refused"))
+        scheduler = self.scheduler(poll)
+        self.schedule(scheduler, "a", [(0, FAST)])
+        scheduler.runPending()
+        poll.error = None
+        self.clock.time = scheduler.nextDue()
+        scheduler.runPending()
+        self.assertEqual(scheduler.nextDue() - self.clock.time, 10)
+
+    def test_busy_logger_groups_are_held_back(self):
+        scheduler = self.scheduler(coalesce=0)
+        self.schedule(scheduler, "a", [(0, FAST), (5, SLOW)])
+        self.assertEqual(scheduler.takeDue(), {"a": [FAST]})
+        self.clock.time = 6
+        # The poll of "a" is still running
+        self.assertEqual(scheduler.takeDue(), {})
+        self.assertEqual(self.entries(scheduler, "a"), [])
+        self.assertIsNone(scheduler.nextDue())
+        scheduler.finish("a", [FAST], {"sRunState": 2})
+        self.assertEqual(self.entries(scheduler, "a"), [(5, "slow"), (16, "fast")])
+        self.assertEqual(scheduler.takeDue(), {"a": [SLOW]})
+
+    def test_remove(self):
+        scheduler = self.scheduler()
+        scheduler.add("a")
+        scheduler.add("b")
+        scheduler.remove("a")
+        self.assertEqual(self.entries(scheduler, "a"), [])
+        self.assertEqual(len(self.entries(scheduler, "b")), 3)
+
+    def test_remove_while_polling(self):
+        scheduler = self.scheduler(coalesce=0)
+        self.schedule(scheduler, "a", [(0, FAST), (1, SLOW), (2, HOURLY)])
+        scheduler.takeDue()
+        self.clock.time = 3
+        scheduler.takeDue()
+        scheduler.remove("a")
+        self.assertNotIn("a", scheduler.inflight)
+        scheduler.finish("a", [FAST], {"sRunState": 2})
+        self.assertEqual(self.entries(scheduler, "a"), [])
+        self.assertEqual(scheduler.deferred, {})
+        self.assertNotIn("a", scheduler.state)
+
+    def test_run_with_manual_clock(self):
+        scheduler = self.scheduler(coalesce=0)
+        self.schedule(scheduler, "a", [(0, FAST), (0, SLOW)])
+        scheduler.run(until=65)
+        # Groups of one logger due at the same time share a poll
+        self.assertEqual(len(self.poll.calls), 7)
+        self.assertEqual(sum("sTotalActivePower" in fields for logger, fields in self.poll.calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
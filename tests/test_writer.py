@@ -0,0 +1,125 @@
+import unittest
+
+import deye
+from deye import DeyeTCPRequest, DeyeTCPResponse, ModbusWriteRequest
+from simulator import SimulatedInverter
+from writer import RegisterWriter, WriteError
+
+SERIAL = 3000000000
+GRID_BOUNDS = {
+    "pGridVoltageUpperLimit": (230, 270),
+    "pGridVoltageLowerLimit": (180, 220),
+    "pGridFrequencyUpperLimit": (50, 52),
+    "pGridFrequencyLowerLimit": (47, 50),
+}
+
+
+class InverterTransport:
+    # Hands each request straight to a simulated inverter
+    def __init__(self, inverter):
+        self.inverter = inverter
+
+    def send(self, data):
+        return self.inverter.handle(bytes(data))
+
+
+class PlanTest(unittest.TestCase):
+
+    def test_single_register(self):
+        self.assertEqual(RegisterWriter().plan([deye.pActivePowerRegulation(value=50)]), [(40, b"\x00\x32")])
+
+    def test_neighbours_are_merged(self):
+        params = [deye.pSwitchEnable(value=1), deye.pActivePowerRegulation(value=80), deye.pFactoryResetEnable(value=0)]
+        self.assertEqual(RegisterWriter().plan(params), [(40, b"\x00\x50"), (43, b"\x00\x01\x00\x00")])
+
+    def test_max_regs_splits_writes(self):
+        params = [deye.pSwitchEnable(value=1), deye.pFactoryResetEnable(value=0), deye.pSelfCheckingTimeIsland(value=60)]
+        self.assertEqual(RegisterWriter(max_regs=2).plan(params), [(43, b"\x00\x01\x00\x00"), (45, b"\x00\x3c")])
+
+    def test_register_written_twice(self):
+        with self.assertRaisesRegex(WriteError, "written twice"):
+            RegisterWriter().plan([deye.pSwitchEnable(value=1), deye.pSwitchEnable(value=0)])
+
+    def test_value_outside_range(self):
+        with self.assertRaisesRegex(WriteError, "outside 0..100"):
+            RegisterWriter().plan([deye.pActivePowerRegulation(value=101)])
+
+    def test_missing_value(self):
+        with self.assertRaisesRegex(WriteError, "has no value"):
+            RegisterWriter(bounds=GRID_BOUNDS).plan([deye.pGridVoltageUpperLimit(), deye.pGridVoltageLowerLimit()])
+
+    def test_read_only_field(self):
+        with self.assertRaisesRegex(WriteError, "no writable range"):
+            RegisterWriter().plan([deye.sGridVoltage(value=230)])
+
+    def test_scaled_values_are_rounded(self):
+        writer = RegisterWriter(bounds=GRID_BOUNDS)
+        self.assertEqual(writer.plan([deye.pGridFrequencyUpperLimit(value=51.07)]), [(29, (5107).to_bytes(2, "big"))])
+
+
+class BoundsTest(unittest.TestCase):
+
+    def test_grid_limits_need_bounds(self):
+        with self.assertRaisesRegex(WriteError, "pass its bounds"):
+            RegisterWriter().plan([deye.pGridVoltageUpperLimit(value=250)])
+
+    def test_grid_limits_with_bounds(self):
+        writer = RegisterWriter(bounds=GRID_BOUNDS)
+        params = [deye.pGridVoltageUpperLimit(value=250), deye.pGridVoltageLowerLimit(value=200)]
+        self.assertEqual(writer.plan(params), [(27, (2500).to_bytes(2, "big") + (2000).to_bytes(2, "big"))])
+
+    def test_value_outside_bounds(self):
+        with self.assertRaisesRegex(WriteError, "outside 230..270"):
+            RegisterWriter(bounds=GRID_BOUNDS).plan([deye.pGridVoltageUpperLimit(value=0)])
+
+    def test_bounds_override_class_range(self):
+        with self.assertRaisesRegex(WriteError, "outside 0..50"):
+            RegisterWriter(bounds={"pActivePowerRegulation": (0, 50)}).plan([deye.pActivePowerRegulation(value=80)])
+
+    def test_lower_limit_above_upper(self):
+        writer = RegisterWriter(bounds={"pGridFrequencyUpperLimit": (45, 55), "pGridFrequencyLowerLimit": (45, 55)})
+        with self.assertRaisesRegex(WriteError, "is not below"):
+            writer.plan([deye.pGridFrequencyUpperLimit(value=50), deye.pGridFrequencyLowerLimit(value=51)])
+        with self.assertRaisesRegex(WriteError, "is not below"):
+            writer.plan([deye.pGridFrequencyUpperLimit(value=50), deye.pGridFrequencyLowerLimit(value=50)])
+
+
+class AckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.inverter = SimulatedInverter(SERIAL, latency=0, jitter=0, vary=False)
+
+    def ack(self, request):
+        return DeyeTCPResponse(self.inverter.handle(DeyeTCPRequest(request, SERIAL).toBytes()))
+
+    def test_write_through_simulator(self):
+        writer = RegisterWriter(bounds=GRID_BOUNDS)
+        params = [deye.pGridFrequencyUpperLimit(value=51.07), deye.pActivePowerRegulation(value=75)]
+        acks = writer.write(InverterTransport(self.inverter), SERIAL, params)
+        self.assertEqual(len(acks), 2)
+        block = bytes(self.inverter.block)
+        self.assertEqual(deye.rModbusResponse.decoder.decodeField(block, "pGridFrequencyUpperLimit"), 51.07)
+        self.assertEqual(deye.rModbusResponse.decoder.decodeField(block, "pActivePowerRegulation"), 75)
+
+    def test_ack_matches_request(self):
+        request = ModbusWriteRequest(40, b"\x00\x32")
+        self.assertIsInstance(RegisterWriter.checkAck(request, self.ack(request)), DeyeTCPResponse)
+
+    def test_ack_for_other_registers(self):
+        with self.assertRaisesRegex(WriteError, "Acknowledged registers 41"):
+            RegisterWriter.checkAck(ModbusWriteRequest(40, b"\x00\x32"), self.ack(ModbusWriteRequest(41, b"\x00\x32")))
+
+    def test_exception_reply(self):
+        request = ModbusWriteRequest(119, b"\x00\x01\x00\x02")
+        with self.assertRaisesRegex(WriteError, "Modbus exception"):
+            RegisterWriter.checkAck(request, self.ack(request))
+
+    def test_read_reply(self):
+        request = ModbusWriteRequest(40, b"\x00\x32")
+        read = deye.ModbusRequest(deye.ModbusRequest.DEYE_READ, 0, 120)
+        with self.assertRaisesRegex(WriteError, "Unexpected response"):
+            RegisterWriter.checkAck(request, self.ack(read))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,30 +1,152 @@
 import socket
+import time
+from framing import FrameReader
 
 class TransportTCP():
 	
 	s = None
 	ip = ""
 	port = 0
+	metrics = None
+	sequence = 0
 	
 	def __init__(self, ip, port):
 		self.ip = ip
 		self.port = port
+		self.framer = FrameReader()
 
 	def send(self, data):
 		if self.s is not None:
-			self.s.send(data)
-			response = self.s.recv(1024)
-			return response
+			if self.metrics is not None:
+				return self.sendInstrumented(data)
+			self.s.sendall(data)
+			return self.recvFrame()
 		return bytes()
 
+	def sendInstrumented(self, data):
+		metrics = self.metrics
+		start = time.perf_counter()
+		try:
+			self.s.sendall(data)
+		except OSError:
+			metrics.errors.inc(stage="send")
+			raise
+		sent = time.perf_counter()
+		metrics.send.observe(sent - start)
+		metrics.bytes_sent.inc(len(data))
+		first = self.framer.pending() > 0
+		try:
+			frame = self.framer.next()
+			while frame is None:
+				n = self.framer.recvInto(self.s)
+				if not first:
+					first = True
+					metrics.first_byte.observe(time.perf_counter() - sent)
+				if n == 0:
+					metrics.errors.inc(stage="closed")
+					return bytes()
+				frame = self.framer.next()
+		except OSError:
+			metrics.errors.inc(stage="recv")
+			raise
+		metrics.recv.observe(time.perf_counter() - sent)
+		metrics.bytes_received.inc(len(frame))
+		return frame
+
+	def sendPipelined(self, frames, window=8):
+		# Sends up to `window` requests back to back and matches responses to
+		# them. The logger only echoes the first frame number byte, so each
+		# outstanding request is stamped with its own value there, and a
+		# response is only accepted when its Modbus frame fits the request;
+		# anything else is dropped. If the logger stops answering, the rest
+		# are sent one at a time.
+		responses = [None] * len(frames)
+		if self.s is None:
+			return [bytes()] * len(frames)
+		window = min(window, 255)
+		frames = [self.stampSequence(frame) for frame in frames]
+		outstanding = {}
+		order = []
+		queued = iter(range(len(frames)))
+		for i in queued:
+			self.s.sendall(frames[i])
+			outstanding[FrameReader.sequence(frames[i])] = i
+			order.append(i)
+			if len(order) >= window:
+				break
+		try:
+			while order:
+				response = self.recvFrame()
+				if not response:
+					break
+				i = outstanding.get(FrameReader.sequence(response))
+				if i is None or not FrameReader.answers(frames[i], response):
+					# Stale or foreign response
+					continue
+				del outstanding[FrameReader.sequence(frames[i])]
+				order.remove(i)
+				responses[i] = response
+				for i in queued:
+					self.s.sendall(frames[i])
+					outstanding[FrameReader.sequence(frames[i])] = i
+					order.append(i)
+					break
+		except socket.timeout:
+			pass
+		for i in range(len(frames)):
+			if responses[i] is None:
+				if self.metrics is not None:
+					self.metrics.retries.inc()
+				responses[i] = self.exchange(frames[i])
+		return responses
+
+	def exchange(self, frame):
+		# Sends frame under a new sequence number and reads until its answer
+		# arrives. Late answers to earlier requests are dropped, so they are
+		# not left queued for the next send().
+		frame = self.stampSequence(frame)
+		self.s.sendall(frame)
+		while True:
+			response = self.recvFrame()
+			if not response:
+				return response
+			if FrameReader.sequence(response) == FrameReader.sequence(frame) and FrameReader.answers(frame, response):
+				return response
+
+	def stampSequence(self, frame):
+		# Copy of frame with the next sequence number in the echoed frame
+		# number byte, the checksum adjusted to match
+		self.sequence = (self.sequence + 1) & 255
+		frame = bytearray(frame)
+		frame[-2] = (frame[-2] - frame[5] + self.sequence) & 255
+		frame[5] = self.sequence
+		return bytes(frame)
+
+	def recvFrame(self):
+		frame = self.framer.next()
+		while frame is None:
+			if self.framer.recvInto(self.s) == 0:
+				return bytes()
+			frame = self.framer.next()
+		return frame
+
 	def stop(self):
 		if self.s is not None:
 			self.s.close()
 			self.s = None
+		self.framer.reset()
 		
 	def start(self):
 		self.stop()
 		self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.s.settimeout(2)
-		self.s.connect((self.ip, self.port))
-
+		if self.metrics is None:
+			self.s.connect((self.ip, self.port))
+			return
+		start = time.perf_counter()
+		try:
+			self.s.connect((self.ip, self.port))
+		except OSError:
+			self.metrics.errors.inc(stage="connect")
+			raise
+		self.metrics.connect.observe(time.perf_counter() - start)
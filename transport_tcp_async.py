@@ -0,0 +1,47 @@
+import asyncio
+from framing import FrameReader
+
+class AsyncTransportTCP():
+	
+	reader = None
+	writer = None
+	ip = ""
+	port = 0
+	
+	def __init__(self, ip, port, timeout=2):
+		self.ip = ip
+		self.port = port
+		self.timeout = timeout
+		self.framer = FrameReader()
+
+	async def send(self, data):
+		if self.writer is not None:
+			self.writer.write(data)
+			await self.writer.drain()
+			return await asyncio.wait_for(self.recvFrame(), self.timeout)
+		return bytes()
+
+	async def recvFrame(self):
+		frame = self.framer.next()
+		while frame is None:
+			data = await self.reader.read(1024)
+			if not data:
+				return bytes()
+			self.framer.feed(data)
+			frame = self.framer.next()
+		return frame
+
+	async def stop(self):
+		if self.writer is not None:
+			self.writer.close()
+			try:
+				await self.writer.wait_closed()
+			except OSError:
+				pass
+			self.reader = None
+			self.writer = None
+		self.framer.reset()
+		
+	async def start(self):
+		await self.stop()
+		self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.ip, self.port), self.timeout)
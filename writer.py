@@ -0,0 +1,91 @@
+from deye import rModbusResponse, ModbusRequest, ModbusWriteRequest, DeyeTCPRequest, DeyeTCPResponse, plainValue
+
+
+class WriteError(RuntimeError):
+    pass
+
+
+class RegisterWriter:
+    # Builds Write Multiple Registers (0x10) requests from changed parameter
+    # objects such as pActivePowerRegulation. Values are checked against
+    # val_min/val_max, or the (min, max) the caller passes in bounds for
+    # parameters without a documented range, and encoded with the rounding
+    # table encoders. Registers that follow each other are merged into one
+    # request of at most max_regs registers.
+    LIMIT_PAIRS = (
+        ("pGridVoltageLowerLimit", "pGridVoltageUpperLimit"),
+        ("pGridFrequencyLowerLimit", "pGridFrequencyUpperLimit"),
+    )
+
+    def __init__(self, decoder=rModbusResponse.decoder, max_regs=123, bounds=None):
+        self.decoder = decoder
+        self.max_regs = max_regs
+        self.bounds = dict(bounds or {})
+
+    def limits(self, param):
+        if param.name in self.bounds:
+            return self.bounds[param.name]
+        return param.val_min, param.val_max
+
+    def registerData(self, param):
+        if param.name not in self.decoder.index:
+            raise WriteError(f"{param.name} is not in the register map")
+        offset, size = self.decoder.index[param.name]
+        if offset % 2 or size % 2:
+            raise WriteError(f"{param.name} does not cover whole registers")
+        val_min, val_max = self.limits(param)
+        if val_min == val_max == 0:
+            raise WriteError(f"{param.name} has no writable range, pass its bounds to RegisterWriter")
+        value = plainValue(param)
+        if value is None or not val_min <= value <= val_max:
+            raise WriteError(f"{param.name} value {value} is outside {val_min}..{val_max}")
+        try:
+            data = self.decoder.encode(param.name, value)
+        except (ValueError, OverflowError) as e:
+            raise WriteError(f"{param.name} cannot be encoded: {e}")
+        return offset // 2, data
+
+    def plan(self, params):
+        values = {param.name: plainValue(param) for param in params}
+        for name, value in values.items():
+            if value is None:
+                raise WriteError(f"{name} has no value")
+        for lower, upper in self.LIMIT_PAIRS:
+            if lower in values and upper in values and values[lower] >= values[upper]:
+                raise WriteError(f"{lower} {values[lower]} is not below {upper} {values[upper]}")
+        writes = []
+        for start, data in sorted(self.registerData(param) for param in params):
+            if writes:
+                prev_start, prev_data = writes[-1]
+                prev_end = prev_start + len(prev_data) // 2
+                if start < prev_end:
+                    raise WriteError(f"Register {start} is written twice")
+                if start == prev_end and len(prev_data + data) // 2 <= self.max_regs:
+                    writes[-1] = (prev_start, prev_data + data)
+                    continue
+            writes.append((start, data))
+        return writes
+
+    def requests(self, params):
+        return [ModbusWriteRequest(start, data) for start, data in self.plan(params)]
+
+    @staticmethod
+    def checkAck(request, response):
+        values = response.values["ModbusResponse"].values
+        command = values["ModbusCommand"].value
+        if "ModbusException" in values:
+            raise WriteError(f"Write to register {request.start_reg} failed with Modbus exception {values['ModbusException'].value}")
+        if command != ModbusRequest.DEYE_WRITE:
+            raise WriteError(f"Unexpected response {command} to write of register {request.start_reg}")
+        start = values["ModbusStartReg"].value
+        count = values["ModbusRegCount"].value
+        if (start, count) != (request.start_reg, request.count_reg):
+            raise WriteError(f"Acknowledged registers {start}+{count}, expected {request.start_reg}+{request.count_reg}")
+        return response
+
+    def write(self, transport, serial, params):
+        acks = []
+        for request in self.requests(params):
+            response = DeyeTCPResponse(transport.send(DeyeTCPRequest(request, serial).toBytes()))
+            acks.append(self.checkAck(request, response))
+        return acks